@@ -14,6 +14,7 @@ import sklearn.model_selection as skm
 from tasks.base import ConfigTask
 from tasks.coffea import CoffeaTask, CoffeaProcessor
 from tasks.grouping import MergeArrays
+from utils.columnar import as_matrix, open_array
 
 
 class ArrayNormalisation(CoffeaTask):
@@ -95,13 +96,13 @@ class ArrayNormalisation(CoffeaTask):
             for i, key in enumerate(self.config_inst.get_aux("DNN_process_template")[cat].keys()):
                 for subproc in self.config_inst.get_aux("DNN_process_template")[cat][key]:
                     print(2, subproc)
-                    proc_list.append(self.input()[cat + "_" + subproc]["array"].load())
+                    proc_list.append(as_matrix(open_array(self.input()[cat + "_" + subproc]["array"])))
 
                 # print(proc_list)
                 proc_dict.update({key: np.concatenate(proc_list)})
                 # build labels for classification
                 output_nodes = len(self.config_inst.get_aux("DNN_process_template")[cat].keys())
-                labels = np.zeros((len(np.concatenate(proc_list)), output_nodes))
+                labels = np.zeros((sum(len(arr) for arr in proc_list), output_nodes))
                 labels[:, i] = 1
                 one_hot_labels.append(labels)
 
@@ -177,13 +178,13 @@ class CrossValidationPrep(CoffeaTask):
             for i, key in enumerate(self.config_inst.get_aux("DNN_process_template")[cat].keys()):
                 for subproc in self.config_inst.get_aux("DNN_process_template")[cat][key]:
                     print(2, subproc)
-                    proc_list.append(self.input()[cat + "_" + subproc]["array"].load())
+                    proc_list.append(as_matrix(open_array(self.input()[cat + "_" + subproc]["array"])))
 
                 # print(proc_list)
                 proc_dict.update({key: np.concatenate(proc_list)})
                 # build labels for classification
                 output_nodes = len(self.config_inst.get_aux("DNN_process_template")[cat].keys())
-                labels = np.zeros((len(np.concatenate(proc_list)), output_nodes))
+                labels = np.zeros((sum(len(arr) for arr in proc_list), output_nodes))
                 labels[:, i] = 1
                 one_hot_labels.append(labels)
 
@@ -1,5 +1,6 @@
-__all__ = ["AnalysisTask", "ConfigTask", "ShiftTask", "DatasetTask"]
+__all__ = ["AnalysisTask", "ConfigTask", "ShiftTask", "DatasetTask", "ManifestMixin"]
 
+import json
 import os
 
 import luigi
@@ -141,6 +142,49 @@ class DatasetTask(ConfigTask):  # ShiftTask
             self.process_inst = None
 
 
+class ManifestMixin(object):
+    """
+    Finished tasks and workflow branches record their outputs in a manifest
+    With --manifest, completeness is decided from it: a workflow lists its manifest directory once
+    instead of checking every target of every branch, targets are only checked for missing entries
+    """
+
+    manifest = luigi.BoolParameter(default=False, significant=False, description="decide completeness from the manifest of finished outputs, remove the manifest directory after deleting outputs by hand")
+
+    def manifest_dir(self):
+        return self.local_directory_target("manifest")
+
+    def manifest_entry(self, branch=None):
+        # branches of a workflow share a directory named after the workflow
+        if isinstance(self, law.BaseWorkflow):
+            workflow = self.as_workflow() if self.is_branch() else self
+            return os.path.join(self.manifest_dir().path, workflow.task_id, str(self.branch if branch is None else branch))
+        return os.path.join(self.manifest_dir().path, self.task_id)
+
+    def write_manifest(self):
+        path = self.manifest_entry()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump([target.path for target in law.util.flatten(self.output())], f)
+        os.replace(path + ".tmp", path)
+
+    def complete(self):
+        # a branch or a plain task without a manifest entry falls back to its targets, nothing is written here
+        if self.manifest and os.path.exists(self.manifest_entry()):
+            return True
+        return super(ManifestMixin, self).complete()
+
+    @property
+    def workflow_complete(self):
+        # the workflow proxy calls this hook if it is callable, otherwise it checks the workflow outputs
+        return self.manifest_workflow_complete if self.manifest else None
+
+    def manifest_workflow_complete(self):
+        directory = os.path.dirname(self.manifest_entry(0))
+        done = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+        return all(str(branch) in done or self.as_branch(branch).complete() for branch in self.get_branch_map())
+
+
 class HTCondorWorkflow(law.htcondor.HTCondorWorkflow):
     debug = luigi.BoolParameter()
     """
@@ -2,28 +2,35 @@
 
 import json
 import logging
+import math
 import os
+import shutil
 import time
 
 import law
 import law.contrib.coffea
 import numpy as np
-import uproot as up
-from coffea import processor, hist
+from coffea import processor, hist, util
 from coffea.nanoevents import BaseSchema, NanoAODSchema, TreeMakerSchema
-from luigi import BoolParameter, IntParameter, ListParameter, Parameter
+from coffea.processor.executor import WorkItem
+from luigi import BoolParameter, ChoiceParameter, IntParameter, ListParameter, Parameter
 from rich.console import Console
 
 # other modules
-from tasks.base import DatasetTask, HTCondorWorkflow
-from utils.coffea_base import ArrayExporter, ArrayAccumulator
+from tasks.base import DatasetTask, HTCondorWorkflow, ManifestMixin
+from utils.coffea_base import ArrayExporter, ArrayAccumulator, CheckpointProcessor, checkpoint_name
 from utils.signal_regions import signal_regions_0b
+from utils.cuts import CompiledCuts, RegionBinning
+from utils.file_index import FileIndex
+from utils.systematics import variations
+from utils.masspoints import scan_datasets
+from utils.columnar import count_rows, load_columns, storage_dtypes, table_columns, write_table
+from utils.bundle import bundle_targets, write_bundle
 from tasks.makefiles import WriteDatasetPathDict, WriteDatasets, CollectInputData
-from tqdm import tqdm
 from utils.coffea_base import ArrayExporter
 
 
-class CoffeaTask(DatasetTask):
+class CoffeaTask(ManifestMixin, DatasetTask):
     """
     token task to define attributes
     shared functions between tasks also defined here
@@ -42,6 +49,21 @@ class CoffeaTask(DatasetTask):
     # parameter with selection we use coffea
     lepton_selection = Parameter(default="Muon")
     datasets_to_process = ListParameter(default=["WJets"])
+    # how the chunks of one file are processed, does not change the outputs
+    executor = ChoiceParameter(default="iterative", choices=["iterative", "futures", "dask-local"], significant=False, description="coffea executor to process chunks with, default: iterative")
+    workers = IntParameter(default=1, significant=False, description="number of cores used by the futures and dask-local executors and by the merge of arrays, default: 1")
+    events_per_branch = IntParameter(default=0, description="pack files into branches of roughly this many events, 0 keeps one file per branch")
+    dual_tree = BoolParameter(default=False, description="process the Muon and Electron trees of a file in the same branch")
+    cut_backend = ChoiceParameter(default="numpy", choices=CompiledCuts.backends, significant=False, description="backend of the fused category masks, numexpr and numba evaluate all cuts of a category in one pass, default: numpy")
+    systematics = BoolParameter(default=False, description="export the weights of all up and down variations next to the nominal weights")
+    demultiplex_masspoints = BoolParameter(default=False, description="keep all mass points of SMS scans and write them split by (mGluino, mNeutralino)")
+    output_format = ChoiceParameter(default="npy", choices=["npy", "parquet", "bundle"], description="format of the exported arrays, parquet writes named columns, bundle one npz file per branch, default: npy")
+    compact_dtypes = BoolParameter(default=False, description="export every variable with the storage dtype declared in variables.py, weights as float32")
+    checkpoint = BoolParameter(default=False, significant=False, description="save finished chunks, so restarted branches skip them")
+    spill_arrays = BoolParameter(default=False, significant=False, description="append merged arrays to files on disk instead of keeping them in memory")
+    lepton_trees = ["Muon", "Electron"]
+    # memoized results of load_job_dict
+    _job_dicts = {}
 
     def get_proc_list(self, datasets):
         # task to return subprocesses for list of datasets
@@ -54,12 +76,87 @@ class CoffeaTask(DatasetTask):
                 proc_list.append(proc.name)
         return proc_list
 
+    def coffea_requires(self, channels, **kwargs):
+        # one workflow per lepton tree, or a single dual tree workflow writing both
+        if self.dual_tree:
+            # lepton_selection is not used by dual tree workflows, fix it so there is only one instance
+            return {"dual": CoffeaProcessor.req(self, lepton_selection=self.lepton_trees[0], **kwargs)}
+        return {sel: CoffeaProcessor.req(self, lepton_selection=sel, **kwargs) for sel in channels}
+
+    def coffea_targets(self, inp, channels):
+        # CoffeaProcessor outputs keyed by lepton channel, the same for both modes
+        # every branch only knows its own targets, they are joined here
+        out = {}
+        for sel in channels:
+            collection = inp["dual"]["collection"] if self.dual_tree else inp[sel]["collection"]
+            out[sel] = {}
+            for targets in collection.targets.values():
+                out[sel].update(targets[sel] if self.dual_tree else targets)
+        if self.output_format == "bundle":
+            out = {sel: self.bundle_members(targets) for sel, targets in out.items()}
+        return out
+
+    def bundle_members(self, targets):
+        # per category view of the bundles, keyed like the npy outputs
+        keys = ["array", "weights"] + (["systematics"] if self.systematics else [])
+        out = {}
+        for job_key, job_targets in targets.items():
+            masspoints = self.demultiplex_masspoints and job_key.rsplit("_", 1)[0] in scan_datasets
+            members = bundle_targets(job_targets["bundle"].path, self.config_inst.categories.names(), keys, masspoints=masspoints)
+            out.update({cat + "_" + job_key: cat_members for cat, cat_members in members.items()})
+        return out
+
+    def job_dataset(self, job):
+        # a job is either a single file or a list of [file, part, n_parts] segments of one dataset
+        if not isinstance(job, str):
+            job = job[0][0]
+        return job.split("/")[0]
+
+    def load_file_index(self):
+        # per file metadata written at dataset discovery
+        return FileIndex(WriteDatasetPathDict.req(self).output()["file_index"].path)
+
+    def load_entries(self, files):
+        # number of entries per lepton tree, taken from the file index
+        return self.load_file_index().entries(files)
+
+    def pack_files(self, files, entries):
+        # files above the target get split into equal parts, then first fit decreasing into bins
+        # counting both lepton trees, so Muon and Electron workflows share the same branch numbering
+        segments = []
+        for file in sorted(files):
+            n_events = sum(entries[file].values())
+            if n_events == 0:
+                continue
+            n_parts = int(math.ceil(n_events / float(self.events_per_branch)))
+            segments.extend((n_events / float(n_parts), [file, part, n_parts]) for part in range(n_parts))
+        bins = []
+        for size, segment in sorted(segments, key=lambda seg: -seg[0]):
+            for b in bins:
+                if b["size"] + size <= self.events_per_branch:
+                    b["size"] += size
+                    b["segments"].append(segment)
+                    break
+            else:
+                bins.append({"size": size, "segments": [segment]})
+        return [b["segments"] for b in bins]
+
     def load_job_dict(self):
-        with open(self.config_inst.get_aux("job_dict").replace(".json", "_" + self.version + ".json")) as f:
+        # parsed once per process for the same file and job layout, every branch and downstream task asks for it
+        path = self.config_inst.get_aux("job_dict").replace(".json", "_" + self.version + ".json")
+        key = (path, os.path.getmtime(path), tuple(self.datasets_to_process), self.events_per_branch, self.debug)
+        if key not in CoffeaTask._job_dicts:
+            CoffeaTask._job_dicts[key] = self.build_job_dict(path)
+        return CoffeaTask._job_dicts[key]
+
+    def build_job_dict(self, path):
+        with open(path) as f:
             data_list = json.load(f)
         job_number = 0  # len(data_list.keys())
         job_number_dict = {}
         data_path = data_list["directory_path"]
+        # job number of every file from the scan, missing for job dicts written before they were kept
+        file_numbers = data_list.get("job_numbers")
         # start with wanted process names, than check for leafs
         for dat in self.datasets_to_process:
             proc = self.config_inst.get_process(dat)
@@ -70,7 +167,15 @@ class CoffeaTask(DatasetTask):
             # for key, files in data_list.items():
             for name in proc_list:
                 files = data_list[name]
-                for i, file in enumerate(sorted(files)):
+                if self.events_per_branch > 0:
+                    # one job per bin, each holding segments of one dataset only
+                    files = self.pack_files(files, self.load_entries(files))
+                elif file_numbers:
+                    # one job per file, the number of a file does not change when others are added
+                    job_number_dict.update({file_numbers[file]: file for file in files})
+                    job_number += len(files)
+                    continue
+                for i, file in enumerate(files):
                     # This section is designed to catch empty files causing uproot to crash
                     # f = up.open(data_path + "/" + file)
                     # # check for empty root file
@@ -82,12 +187,14 @@ class CoffeaTask(DatasetTask):
                 job_number += len(files)
         if self.debug:
             job_number = 1
-            job_number_dict = {0: job_number_dict[0]}
+            first = min(job_number_dict)
+            job_number_dict = {first: job_number_dict[first]}
         return data_list, job_number, job_number_dict
 
 
 class CoffeaProcessor(CoffeaTask, HTCondorWorkflow, law.LocalWorkflow):
     additional_plots = BoolParameter(default=False)
+    chunksize = 10000
     """
     this is a HTCOndor workflow, normally it will get submitted with configurations defined
     in the htcondor_bottstrap.sh or the basetasks.HTCondorWorkflow
@@ -104,36 +211,129 @@ class CoffeaProcessor(CoffeaTask, HTCondorWorkflow, law.LocalWorkflow):
         # return WriteDatasets.req(self)
 
     def create_branch_map(self):
-        # define job number according to number of files of the dataset that you want to process
-        job_number = self.load_job_dict()[1]
-        return list(range(job_number))
+        # one branch per file or packed job, the branch data is the file or its segments
+        return self.load_job_dict()[2]
 
     def output(self):
-        files, job_number, job_number_dict = self.load_job_dict()
+        # only the targets of this branch, the workflow collects them over its branch map
+        jobs = {self.branch: self.branch_data}
+        if self.dual_tree:
+            return {lep: self.job_outputs(jobs, lep) for lep in self.lepton_trees}
+        return self.job_outputs(jobs)
+
+    def job_outputs(self, job_number_dict, lep=None):
+        # dual tree branches write both trees, so each lepton gets its own directory
+        parts = (lep,) if lep else ()
+        if self.output_format == "bundle":
+            # all categories and histograms of a job in one file
+            return {self.job_dataset(dat) + "_" + str(job): {"bundle": self.local_target(*parts + (self.job_dataset(dat) + "_" + str(job) + ".npz",))} for job, dat in job_number_dict.items()}
         out = {
             cat
             + "_"
-            + dat.split("/")[0]
+            + self.job_dataset(dat)
             + "_"
             + str(job): {
-                "array": self.local_target(cat + "_" + dat.split("/")[0] + "_" + str(job) + ".npy"),
-                "weights": self.local_target(cat + "_" + dat.split("/")[0] + "_" + str(job) + "_weights.npy"),
-                # "sum_gen_weights": self.local_target(cat + "_" + dat.split("/")[0] + "_" + str(job) + "_sum_gen_weights.npy"),
-                "cutflow": self.local_target(cat + "_" + dat.split("/")[0] + "_" + str(job) + "cutflow.coffea"),
-                "n_minus1": self.local_target(cat + "_" + dat.split("/")[0] + "_" + str(job) + "n_minus1.coffea"),
+                "array": self.local_target(*parts + (cat + "_" + self.job_dataset(dat) + "_" + str(job) + ".npy",)),
+                "weights": self.local_target(*parts + (cat + "_" + self.job_dataset(dat) + "_" + str(job) + "_weights.npy",)),
+                # "sum_gen_weights": self.local_target(cat + "_" + self.job_dataset(dat) + "_" + str(job) + "_sum_gen_weights.npy"),
+                "cutflow": self.local_target(*parts + (cat + "_" + self.job_dataset(dat) + "_" + str(job) + "cutflow.coffea",)),
+                "n_minus1": self.local_target(*parts + (cat + "_" + self.job_dataset(dat) + "_" + str(job) + "n_minus1.coffea",)),
             }
             for cat in self.config_inst.categories.names()
             for job, dat in job_number_dict.items()
             # for i in range(job_number)  + "_" + str(job_number)
         }
+        if self.output_format == "parquet":
+            # arrays, weights and systematics as named columns of one table
+            for key, targets in out.items():
+                del targets["array"], targets["weights"]
+                targets["table"] = self.local_target(*parts + (key + ".parquet",))
+        elif self.systematics:
+            for key, targets in out.items():
+                targets["systematics"] = self.local_target(*parts + (key + "_systematics.npy",))
+        if self.demultiplex_masspoints:
+            for job, dat in job_number_dict.items():
+                if self.job_dataset(dat) in scan_datasets:
+                    for cat in self.config_inst.categories.names():
+                        key = cat + "_" + self.job_dataset(dat) + "_" + str(job)
+                        out[key]["masspoints"] = self.local_target(*parts + (key + "_masspoints.npz",))
         return out
 
     def store_parts(self):
-        parts = (self.analysis_choice, self.processor, self.lepton_selection)
+        parts = (self.analysis_choice, self.processor, "dual" if self.dual_tree else self.lepton_selection)
         if self.debug:
             parts += ("debug",)
+        if self.events_per_branch > 0:
+            parts += ("packed_{}".format(self.events_per_branch),)
         return super(CoffeaProcessor, self).store_parts() + parts
 
+    def htcondor_job_config(self, config, job_num, branches):
+        config = super(CoffeaProcessor, self).htcondor_job_config(config, job_num, branches)
+        # book as many cores as the executor is going to use
+        if self.executor != "iterative":
+            config.custom_content.append(("request_cpus", str(self.workers)))
+        return config
+
+    def get_executor(self):
+        # returns the coffea executor and a cleanup function for everything started here
+        if self.executor == "futures":
+            return processor.FuturesExecutor(workers=self.workers, status=False), lambda: None
+        if self.executor == "dask-local":
+            from distributed import Client, LocalCluster
+
+            cluster = LocalCluster(n_workers=self.workers, threads_per_worker=1, processes=True)
+            client = Client(cluster)
+
+            def close():
+                client.close()
+                cluster.close()
+
+            return processor.DaskExecutor(client=client, status=False), close
+        return processor.IterativeExecutor(status=False), lambda: None
+
+    def empty_output(self, dataset):
+        # placeholder output for jobs without any events, dtypes and widths as written by the processor
+        variables = self.config_inst.variables
+        if self.compact_dtypes:
+            hl, weights = np.zeros(0, dtype=storage_dtypes(variables)), np.zeros(0, dtype=np.float32)
+        else:
+            hl, weights = np.zeros((0, len(variables)), dtype=np.float32), np.zeros(0, dtype=np.float64)
+        out = {"cutflow": hist.Hist("Counts", hist.Bin("cutflow", "Cut", 20, 0, 20)), "n_minus1": hist.Hist("Counts", hist.Bin("Nminus1", "Cut", 20, 0, 20)), "arrays": {}}
+        for cat in ["N0b_", "N1ib_"]:
+            arrays = {"hl": ArrayAccumulator(hl.copy()), "weights": ArrayAccumulator(weights.copy())}
+            if self.systematics:
+                arrays["systematics"] = ArrayAccumulator(np.zeros((0, len(variations)), dtype=np.float32))
+            out["arrays"][cat + dataset] = arrays
+        return out
+
+    def get_work_items(self, dataset, data_path, segments, treename, metadata, file_index):
+        # turn the [file, part, n_parts] segments of a job into coffea chunks of this tree
+        items = []
+        for file, part, n_parts in segments:
+            row = file_index.get(file)
+            n_entries = row["entries"].get(treename, 0)
+            start, stop = n_entries * part // n_parts, n_entries * (part + 1) // n_parts
+            for chunk_start in range(start, stop, self.chunksize):
+                items.append(WorkItem(dataset, data_path + "/" + file, treename, chunk_start, min(chunk_start + self.chunksize, stop), bytes.fromhex(row["uuid"]), metadata))
+        return items
+
+    def checkpoint_dir(self):
+        # next to the outputs, so it survives the eviction of the condor slot
+        return self.local_directory_target("checkpoints_{}".format(self.branch))
+
+    def spill_dir(self):
+        # next to the outputs, the spilled arrays are moved to their targets at the end
+        return self.local_directory_target("spill_{}".format(self.branch))
+
+    def load_checkpoints(self, scratch_dir, chunks):
+        # outputs of chunks finished by an earlier attempt of this branch
+        done = {}
+        for item in chunks:
+            name = checkpoint_name(item.treename, item.filename, item.entrystart, item.entrystop)
+            if os.path.exists(os.path.join(scratch_dir, name)):
+                done[name] = util.load(os.path.join(scratch_dir, name))
+        return done
+
     @law.decorator.timeit(publish_message=True)
     def run(self):
         data_dict = self.input()["files"]["dataset_dict"].load()  # ["SingleMuon"]  # {self.dataset: [self.file]}
@@ -141,97 +341,152 @@ class CoffeaProcessor(CoffeaTask, HTCondorWorkflow, law.LocalWorkflow):
         sum_gen_weights_dict = self.input()["weights"]["sum_gen_weights"].load()
         # declare processor
         if self.processor == "ArrayExporter":
-            processor_inst = ArrayExporter(self, Lepton=self.lepton_selection, additional_plots=self.additional_plots)
+            spill_dir = None
+            if self.spill_arrays:
+                # files of an earlier attempt are incomplete
+                shutil.rmtree(self.spill_dir().path, ignore_errors=True)
+                self.spill_dir().touch()
+                spill_dir = self.spill_dir().path
+            processor_inst = ArrayExporter(self, Lepton=self.lepton_selection, additional_plots=self.additional_plots, systematics=self.systematics, spill_dir=spill_dir)
         if self.processor == "Histogramer":
             processor_inst = Histogramer(self)
         # building together the respective strings to use for the coffea call
-        files, job_number, job_number_dict = self.load_job_dict()
-        treename = self.lepton_selection
+        treenames = self.lepton_trees if self.dual_tree else [self.lepton_selection]
         # key_name = self.datasets_to_process[self.branch] # list(data_dict.keys())[0]
-        subset = job_number_dict[self.branch]
-        dataset = subset.split("/")[0]  # split("_")[0]
+        subset = self.branch_data
+        dataset = self.job_dataset(subset)  # split("_")[0]
         if dataset == "merged":
             dataset = data_path.split("/")[-2]
-
-        # check for empty dataset
-        empty = False
-
-        with up.open(data_path + "/" + subset) as file:
-            # data_path + "/" + subset[self.branch]
-            primaryDataset = file["MetaData"]["primaryDataset"].array()[0]
-            isData = file["MetaData"]["IsData"].array()[0]
-            isFastSim = file["MetaData"]["IsFastSim"].array()[0]
-            if not isData:
-                # assert all events with the same Xsec in scope with float precision
-                # assert abs(np.mean(file["MetaData"]["xSection"].array()) - file["MetaData"]["xSection"].array()[0]) < file["MetaData"]["xSection"].array()[0] * 1e-5
-                # FIXME xSec = file["MetaData"]["xSection"].array()[0]
-                xSec = self.config_inst.get_process(dataset).xsecs[13].nominal
-                lumi = file["MetaData"]["Luminosity"].array()[0]
-                # if empty skip and construct placeholder output
-                if len(file[treename]["Event"].array()) == 0:
-                    empty = True
-                    out = {"cutflow": hist.Hist("Counts", hist.Bin("cutflow", "Cut", 20, 0, 20)), "n_minus1": hist.Hist("Counts", hist.Bin("Nminus1", "Cut", 20, 0, 20)), "arrays": {"N0b_" + dataset: {"hl": ArrayAccumulator(np.reshape(np.array([], dtype=np.float64), (0, 24))), "weights": ArrayAccumulator(np.array([], dtype=np.float64))}, "N1ib_" + dataset: {"hl": ArrayAccumulator(np.reshape(np.array([], dtype=np.float64), (0, 24))), "weights": ArrayAccumulator(np.array([], dtype=np.float64))}}}
-                # sum_gen_weight = np.sum(file["MetaData"]["SumGenWeight"].array())
-            else:
-                # filler values so they are defined
-                xSec = 1
-                lumi = 1
-        fileset = {
-            dataset: {
-                "files": [data_path + "/" + subset],  # file for file in
-                "metadata": {"PD": primaryDataset, "isData": isData, "isFastSim": isFastSim, "xSec": xSec, "Luminosity": lumi, "sumGenWeight": sum_gen_weights_dict[dataset]},
-            }
-        }
-        if not empty:
+        # packed jobs hold [file, part, n_parts] segments of the same dataset, a single file is one segment
+        segments = [[subset, 0, 1]] if isinstance(subset, str) else subset
+
+        # metadata comes from the index, no need to open the file here
+        # it is looked up once and shared by all trees of the job
+        file_index = self.load_file_index()
+        row = file_index.get(segments[0][0])
+        primaryDataset = row["primary_dataset"]
+        isData = row["is_data"]
+        isFastSim = row["is_fastsim"]
+        if not isData:
+            # assert all events with the same Xsec in scope with float precision
+            # FIXME xSec = file["MetaData"]["xSection"].array()[0]
+            xSec = self.config_inst.get_process(dataset).xsecs[13].nominal
+            lumi = row["luminosity"]
+        else:
+            # filler values so they are defined
+            xSec = 1
+            lumi = 1
+        metadata = {"PD": primaryDataset, "isData": isData, "isFastSim": isFastSim, "xSec": xSec, "Luminosity": lumi, "sumGenWeight": sum_gen_weights_dict[dataset]}
+
+        # chunks of all trees go through the executor together
+        work_items = {tree: self.get_work_items(dataset, data_path, segments, tree, metadata, file_index) for tree in treenames}
+        chunks = [item for tree in treenames for item in work_items[tree]]
+        runner_inst = processor_inst
+        done = {}
+        if self.checkpoint:
+            scratch = self.checkpoint_dir()
+            scratch.touch()
+            done = self.load_checkpoints(scratch.path, chunks)
+            chunks = [item for item in chunks if checkpoint_name(item.treename, item.filename, item.entrystart, item.entrystop) not in done]
+            runner_inst = CheckpointProcessor(processor_inst, scratch.path)
+        outs = {}
+        if chunks or done:
             start = time.time()
-            # call imported processor, magic happens here
-            out = processor.run_uproot_job(
-                fileset,
-                treename=treename,
-                processor_instance=processor_inst,
-                # pre_executor=processor.futures_executor,
-                # pre_args=dict(workers=32),
-                executor=processor.iterative_executor,
-                executor_args=dict(status=False),  # desc="", unit="Trolling"), # , desc="Trolling"
+            executor, close_executor = self.get_executor()
+            # chunks of the same file are distributed over the workers, the ArrayAccumulators get merged afterwards
+            runner = processor.Runner(
+                executor=executor,
                 # metadata_cache = 'MetaData',
-                # schema=BaseSchema,),
-                chunksize=10000,
+                schema=BaseSchema,
+                chunksize=self.chunksize,
             )
+            # resumed chunks are added to the fresh ones
+            results = list(done.values())
+            try:
+                # call imported processor, magic happens here
+                # the tree of each chunk is set in its WorkItem, treename is only used for plain filesets
+                if chunks:
+                    results.append(runner(chunks, treenames[0], processor_instance=runner_inst))
+            finally:
+                close_executor()
+            out = results[0]
+            for result in results[1:]:
+                out.add(result)
+            # dual tree processors key their output by tree name
+            outs = dict(out) if self.dual_tree else {self.lepton_selection: out}
             # show summary
             console = Console()
-            all_events = out["n_events"]["sumAllEvents"]
+            all_events = sum(outs[tree]["n_events"]["sumAllEvents"] for tree in outs)
             total_time = time.time() - start
             console.print("\n[u][bold magenta]Summary metrics:[/bold magenta][/u]")
+            console.print(f"* Executor: {self.executor} ({self.workers if self.executor != 'iterative' else 1} workers)")
+            console.print(f"* Trees: {', '.join(treenames)}")
+            if self.checkpoint:
+                console.print(f"* Chunks resumed from checkpoints: {len(done)} of {len(done) + len(chunks)}")
             console.print(f"* Total time: {total_time:.2f}s")
             console.print(f"* Total events: {all_events:e}")
-            console.print(f"* Events / s: {all_events/total_time:.0f}")
+            console.print(f"* Events / s ({self.executor}): {all_events/total_time:.0f}")
+            # branch sizes come from the file index, the files are not opened again
+            job_files = sorted(set(seg[0] for seg in segments))
+            for tree in treenames:
+                skipped, total = processor_inst.column_resolvers[tree].skipped_bytes(file_index.branch_bytes(job_files, tree), isData, dataset)
+                console.print(f"* Not read (pruned columns, {tree}): {skipped / 1e6:.1f} MB of {total / 1e6:.1f} MB")
+        # if a tree is empty skip and construct placeholder output
+        for tree in treenames:
+            if not work_items[tree]:
+                outs[tree] = self.empty_output(dataset)
         # save outputs, seperated for processor, both need different touch calls
         if self.processor == "ArrayExporter":
             print("saving", subset)
-            self.output().popitem()[1]["array"].parent.touch()
-            for cat in out["arrays"]:
-                self.output()[cat + "_" + str(self.branch)]["weights"].dump(out["arrays"][cat]["weights"].value)
-                self.output()[cat + "_" + str(self.branch)]["array"].dump(out["arrays"][cat]["hl"].value)
-                self.output()[cat + "_" + str(self.branch)]["cutflow"].dump(out["cutflow"])
-                self.output()[cat + "_" + str(self.branch)]["n_minus1"].dump(out["n_minus1"])
+            outputs = self.output()
+            for tree, out in outs.items():
+                targets = outputs[tree] if self.dual_tree else outputs
+                if self.output_format == "bundle":
+                    bundle = targets[self.job_dataset(subset) + "_" + str(self.branch)]["bundle"]
+                    bundle.parent.touch()
+                    # categories are stored without the dataset, the histograms only once
+                    arrays = {cat[: -len(dataset) - 1]: {"array" if key == "hl" else key: array.value for key, array in cat_arrays.items()} for cat, cat_arrays in out["arrays"].items()}
+                    masspoints = {}
+                    for cat, points in out.get("masspoints", {}).items():
+                        masspoints[cat[: -len(dataset) - 1]] = {name: dict({key: array.value for key, array in point_arrays.items()}, sum_gen_weight=np.array(out["masspoint_sum_gen_weights"][name])) for name, point_arrays in points.items()}
+                    write_bundle(bundle.path, arrays, {"cutflow": out["cutflow"], "n_minus1": out["n_minus1"]}, masspoints)
+                    continue
+                list(targets.values())[0]["cutflow"].parent.touch()
+                for cat in out["arrays"]:
+                    if self.output_format == "parquet":
+                        write_table(targets[cat + "_" + str(self.branch)]["table"].path, table_columns({key: array.value for key, array in out["arrays"][cat].items()}, self.config_inst.variables.names()))
+                    else:
+                        out["arrays"][cat]["weights"].dump(targets[cat + "_" + str(self.branch)]["weights"])
+                        out["arrays"][cat]["hl"].dump(targets[cat + "_" + str(self.branch)]["array"])
+                    targets[cat + "_" + str(self.branch)]["cutflow"].dump(out["cutflow"])
+                    targets[cat + "_" + str(self.branch)]["n_minus1"].dump(out["n_minus1"])
+                    if self.systematics and self.output_format == "npy":
+                        out["arrays"][cat]["systematics"].dump(targets[cat + "_" + str(self.branch)]["systematics"])
+                    if "masspoints" in targets[cat + "_" + str(self.branch)]:
+                        # arrays and sum of generator weights of every mass point in one file
+                        content = {}
+                        for name, arrays in out.get("masspoints", {}).get(cat, {}).items():
+                            content.update({name + "_" + key: array.value for key, array in arrays.items()})
+                            content[name + "_sum_gen_weight"] = np.array(out["masspoint_sum_gen_weights"][name])
+                        np.savez(targets[cat + "_" + str(self.branch)]["masspoints"].path, **content)
+        # outputs are complete, the chunks are not needed anymore
+        if self.checkpoint:
+            shutil.rmtree(self.checkpoint_dir().path, ignore_errors=True)
+        if self.spill_arrays:
+            shutil.rmtree(self.spill_dir().path, ignore_errors=True)
+        self.write_manifest()
 
 
 class CollectCoffeaOutput(CoffeaTask):
     def requires(self):
-        return {
-            sel: CoffeaProcessor.req(
-                self,
-                lepton_selection=sel,
-                # workflow="local",
-            )
-            for sel in ["Electron", "Muon"]
-        }
+        return self.coffea_requires(["Electron", "Muon"])
 
     # def output(self):
     def output(self):
         return {
             "event_counts": self.local_target("event_counts.json"),
             "signal_bin_counts": self.local_target("signal_bin_counts.json"),
+            "signal_bin_yields": self.local_target("signal_bin_yields.json"),
         }
 
     def store_parts(self):
@@ -240,7 +495,7 @@ class CollectCoffeaOutput(CoffeaTask):
     @law.decorator.timeit(publish_message=True)
     @law.decorator.safe_output
     def run(self):
-        in_dict = self.input()  # ["collection"].targets
+        in_dict = self.coffea_targets(self.input(), ["Electron", "Muon"])  # ["collection"].targets
 
         # making clear which index belongs to which variable
         var_names = self.config_inst.variables.names()
@@ -249,48 +504,37 @@ class CollectCoffeaOutput(CoffeaTask):
         event_counts = {}
         # initialize
         signal_bin_counts = {k: 0 for k in signal_regions_0b.keys()}
+        signal_bin_sumw = np.zeros(len(signal_regions_0b))
+        signal_bin_sumw2 = np.zeros(len(signal_regions_0b))
+        # all regions are bins of one lookup table, each event is assigned to its region in one pass
+        binning = RegionBinning.from_regions(signal_regions_0b)
+        # exported names of the region variables, the lower bounds shared by all regions skip rows before they are read
+        region_names = {"Dphi": "dPhi", "LT": "LT", "HT": "HT", "n_jets": "nJets"}
+        filters = [(region_names[var], op, value) for var, op, value in binning.lower_bounds()]
         # iterate over the indices for each file
         for key, value in in_dict.items():
-            np_dict = value["collection"].targets[0]
+            np_dict = value
             for dat in self.datasets_to_process:
                 tot_events, signal_events = 0, 0
                 # different key for each file, we ignore it for now, only interested in values
                 for file, value in np_dict.items():
                     cat = "N0b"  # or loop over self.config_inst.categories.names()
                     if cat in file and dat in file:
-                        np_0b = np_dict[file]["array"].load()
+                        # only the columns of the signal regions are read
+                        columns = load_columns(np_dict[file], ["dPhi", "LT", "HT", "nJets", "weights"], var_names, filters=filters)
                         # np_1ib = np.load(value["N1ib_" + dataset])
 
-                        Dphi = np_0b[:, var_names.index("dPhi")]
-                        LT = np_0b[:, var_names.index("LT")]
-                        HT = np_0b[:, var_names.index("HT")]
-                        n_jets = np_0b[:, var_names.index("nJets")]
-
-                        for ke in signal_regions_0b.keys():
-                            signal_bin_counts[ke] += len(np_0b[eval(signal_regions_0b[ke][0]) & eval(signal_regions_0b[ke][1]) & eval(signal_regions_0b[ke][2]) & eval(signal_regions_0b[ke][3])])
-
-                        # at some point, we have to define the signal regions
-                        LT1_nj5 = np_0b[(LT > 250) & (LT < 450) & (Dphi > 1) & (HT > 500) & (n_jets == 5)]
-                        LT1_nj67 = np_0b[(LT > 250) & (LT < 450) & (Dphi > 1) & (HT > 500) & (n_jets >= 6) & (n_jets <= 7)]
-                        LT1_nj8i = np_0b[(LT > 250) & (LT < 450) & (Dphi > 1) & (HT > 500) & (n_jets >= 8)]
-
-                        LT2_nj5 = np_0b[(LT > 450) & (LT < 650) & (Dphi > 0.75) & (HT > 500) & (n_jets == 5)]
-                        LT2_nj67 = np_0b[(LT > 450) & (LT < 650) & (Dphi > 0.75) & (HT > 500) & (n_jets >= 6) & (n_jets <= 7)]
-                        LT2_nj8i = np_0b[(LT > 450) & (LT < 650) & (Dphi > 0.75) & (HT > 500) & (n_jets >= 8)]
-
-                        LT3_nj5 = np_0b[(LT > 650) & (Dphi > 0.5) & (HT > 500) & (n_jets == 5)]
-                        LT3_nj67 = np_0b[(LT > 650) & (Dphi > 0.5) & (HT > 500) & (n_jets >= 6) & (n_jets <= 7)]
-                        LT3_nj8i = np_0b[(LT > 650) & (Dphi > 0.5) & (HT > 500) & (n_jets >= 8)]
-
-                        signal_events += len(LT1_nj5) + len(LT1_nj67) + len(LT1_nj8i) + len(LT2_nj5) + len(LT2_nj67) + len(LT2_nj8i) + len(LT3_nj5) + len(LT3_nj67) + len(LT3_nj8i)
+                        region_columns = {"Dphi": columns["dPhi"], "LT": columns["LT"], "HT": columns["HT"], "n_jets": columns["nJets"]}
+                        counts, sumw, sumw2 = binning.yields(region_columns, columns["weights"])
+                        for ke, count in zip(binning.names, counts):
+                            signal_bin_counts[ke] += int(count)
+                        signal_bin_sumw += sumw
+                        signal_bin_sumw2 += sumw2
 
-                        tot_events += len(np_0b)
+                        # events in any of the signal regions
+                        signal_events += int(np.sum(counts))
 
-                        # print(signal_events)
-                        itot = 0
-                        for it in signal_bin_counts.values():
-                            itot += it
-                        # print(itot, "\n")
+                        tot_events += count_rows(np_dict[file])
                 count_dict = {
                     key
                     + "_"
@@ -305,6 +549,7 @@ class CollectCoffeaOutput(CoffeaTask):
         print(signal_bin_counts)
         self.output()["event_counts"].dump(event_counts)
         self.output()["signal_bin_counts"].dump(signal_bin_counts)
+        self.output()["signal_bin_yields"].dump({name: {"sumw": float(signal_bin_sumw[i]), "sumw2": float(signal_bin_sumw2[i])} for i, name in enumerate(binning.names)})
 
         vals = 0
         for key in signal_bin_counts.keys():
@@ -14,6 +14,11 @@ from tqdm import tqdm
 from tasks.coffea import CoffeaProcessor, CoffeaTask
 from tasks.makefiles import WriteDatasetPathDict, WriteDatasets
 from tasks.base import HTCondorWorkflow
+from utils.file_index import FileIndex
+from utils.cuts import ArrayColumns, CompiledCuts, Cut
+from utils.columnar import load_arrays, load_columns, load_systematics, open_array
+from utils.merging import materialize_parallel, merge_parallel, reduce_histograms, write_virtual
+from utils.systematics import shifted_templates
 
 
 class GroupCoffea(CoffeaTask):
@@ -23,7 +28,7 @@ class GroupCoffea(CoffeaTask):
     """
 
     def requires(self):
-        return CoffeaProcessor.req(self, lepton_selection=self.lepton_selection, additional_plots=True)
+        return self.coffea_requires([self.lepton_selection], additional_plots=True)
 
     def output(self):
         return {
@@ -31,13 +36,20 @@ class GroupCoffea(CoffeaTask):
             self.lepton_selection + "_n_minus1": self.local_target(self.lepton_selection + "_n_minus1.coffea"),
         }
 
+    def job_histograms(self, inp):
+        # every category of a job holds the same cutflow and N-1 histograms, only one copy per job is kept
+        jobs = {}
+        for key, targets in inp.items():
+            cat = max((cat for cat in self.config_inst.categories.names() if key.startswith(cat + "_")), key=len)
+            jobs.setdefault(key[len(cat) + 1 :], (targets["cutflow"], targets["n_minus1"]))
+        return list(jobs.values())
+
     def run(self):
-        inp = self.input()["collection"].targets[0]
-        cut0 = inp[list(inp.keys())[0]]["cutflow"].load()
-        minus0 = inp[list(inp.keys())[0]]["n_minus1"].load()
-        for key in list(inp.keys())[1:]:
-            cut0 += inp[key]["cutflow"].load()
-            minus0 += inp[key]["n_minus1"].load()
+        inp = self.coffea_targets(self.input(), [self.lepton_selection])[self.lepton_selection]
+        histograms = reduce_histograms(self.job_histograms(inp), workers=self.workers)
+        if histograms is None:
+            raise ValueError("no cutflow histograms in the inputs of {}".format(self.lepton_selection))
+        cut0, minus0 = histograms
 
         print(cut0.values())
         self.output()[self.lepton_selection + "_cutflow"].dump(cut0)
@@ -46,71 +58,132 @@ class GroupCoffea(CoffeaTask):
 
 class MergeArrays(CoffeaTask):  # , law.LocalWorkflow, HTCondorWorkflow):
     channel = luigi.ListParameter(default=["Muon", "Electron"])  # , "Electron"])
+    virtual_merge = luigi.BoolParameter(default=False, description="only write manifests of the job arrays instead of concatenating them, needs the npy output")
+    materialize = luigi.BoolParameter(default=False, description="write the npy files from the manifests of a virtual merge instead of from the job outputs")
 
     # def create_branch_map(self):
     # # 1 job only
     # return list(range(1))
 
     def requires(self):
-        inp = {
-            sel: CoffeaProcessor.req(
-                self,
-                lepton_selection=sel,
-                # workflow="local",
-                datasets_to_process=self.datasets_to_process,
-            )
-            for sel in self.channel
-        }
+        if self.materialize:
+            return MergeArrays.req(self, virtual_merge=True, materialize=False)
+        inp = self.coffea_requires(self.channel, datasets_to_process=self.datasets_to_process)
         return inp
 
     def output(self):
-        out = {cat + "_" + dat: {"array": self.local_target("merged_{}_{}.npy".format(cat, dat)), "weights": self.local_target("weights_{}_{}.npy".format(cat, dat))} for cat in self.config_inst.categories.names() for dat in self.datasets_to_process}
+        # a virtual merge writes manifests in place of the arrays
+        ext = ".merge.json" if self.virtual_merge else ".npy"
+        out = {cat + "_" + dat: {"array": self.local_target("merged_{}_{}{}".format(cat, dat, ext)), "weights": self.local_target("weights_{}_{}{}".format(cat, dat, ext))} for cat in self.config_inst.categories.names() for dat in self.datasets_to_process}
+        if self.systematics:
+            for cat in self.config_inst.categories.names():
+                for dat in self.datasets_to_process:
+                    out[cat + "_" + dat]["systematics"] = self.local_target("systematics_{}_{}{}".format(cat, dat, ext))
         # out.update({"sum_gen_weights": self.local_target("sum_gen_weights.json")})
         return out
 
+    def process_jobs(self):
+        # process -> job numbers, built in one pass over the job dict
+        _, _, job_number_dict = self.load_job_dict()
+        index = {}
+        for ind, job in job_number_dict.items():
+            index.setdefault(self.job_dataset(job), []).append(ind)
+        return index
+
     @law.decorator.timeit(publish_message=True)
     @law.decorator.safe_output
     def run(self):
+        if self.virtual_merge and self.output_format != "npy":
+            raise ValueError("a virtual merge needs the npy output of CoffeaProcessor, not {}".format(self.output_format))
+        if self.materialize:
+            if self.virtual_merge:
+                raise ValueError("materialize writes the npy files of a virtual merge, it can not be combined with virtual_merge")
+            outputs = self.output()
+            list(outputs.values())[0]["array"].parent.touch()
+            # the job files are copied into the merged files as listed in the manifests
+            manifests = self.input()
+            materialize_parallel([(manifests[key][name].path, target.path) for key, targets in outputs.items() for name, target in targets.items()], workers=self.workers)
+            self.write_manifest()
+            return
         # construct an inverse map to corrently assign coffea outputs to respective datasets
-        procs = self.get_proc_list(self.datasets_to_process)
-        _, _, job_number_dict = self.load_job_dict()
-        inverse_np_dict = {}
-        for p in procs:
-            for ind, file in job_number_dict.items():
-                if p == file.split("/")[0]:
-                    if p not in inverse_np_dict.keys():
-                        inverse_np_dict[p] = [ind]
-                    else:
-                        inverse_np_dict[p] += [ind]
+        inverse_np_dict = self.process_jobs()
 
+        coffea_targets = self.coffea_targets(self.input(), self.channel)
+        var_names = self.config_inst.variables.names()
+        outputs = self.output()
+        list(outputs.values())[0]["array"].parent.touch()
+        # (merged file, job files) of every dataset, category and key, npy outputs are merged file to file
+        merges = []
         for dat in tqdm(self.datasets_to_process):
             # check if job either in root process or leafes
             proc_list = self.get_proc_list([dat])
             if dat == "TTbar":
                 proc_list = [p for p in proc_list if "TTTo" in p]
             for cat in self.config_inst.categories.names():
+                # merging different lepton channels together according to self.channel
+                # the keys are constructed from the job index, multiple jobs of the same process get their own numbers
+                job_targets = [coffea_targets[lep][cat + "_" + p + "_" + str(ind)] for lep in self.channel for p in proc_list for ind in inverse_np_dict.get(p, [])]
+                if self.output_format == "npy":
+                    merges.extend((target.path, [targets[key].path for targets in job_targets]) for key, target in outputs[cat + "_" + dat].items())
+                    continue
+                # parquet and bundle outputs are read and concatenated
                 cat_list = []
                 weights_list = []
-                # merging different lepton channels together according to self.channel
-                for lep in self.channel:
-                    np_dict = self.input()[lep]["collection"].targets[0]
-                    # looping over all keys each time is rather slow
-                    # but constructing keys yourself is tricky since there can be multiple jobs with different numbers
-                    # so now I loop over possible keys for each dataset and append the correct arrays
-                    for p in proc_list:
-                        for ind in inverse_np_dict[p]:
-                            key = cat + "_" + p + "_" + str(ind)
-                            cat_list.append(np_dict[key]["array"].load())
-                            # get weights as well for each process
-                            weights_list.append(np_dict[key]["weights"].load())
+                systematics_list = []
+                for targets in job_targets:
+                    # get weights as well for each process
+                    array, weights = load_arrays(targets, var_names)
+                    cat_list.append(array)
+                    weights_list.append(weights)
+                    if self.systematics:
+                        systematics_list.append(load_systematics(targets))
 
                 # float 16 so arrays can be saved easily
                 full_arr = np.concatenate(cat_list)  # , dtype=np.float16
                 weights_arr = np.concatenate(weights_list)  # , dtype=np.float16) -> leads to inf
                 # print(dat, cat, full_arr, weights_arr)
-                self.output()[cat + "_" + dat]["array"].parent.touch()
-                self.output()[cat + "_" + dat]["array"].dump(full_arr)
-                self.output()[cat + "_" + dat]["weights"].dump(weights_arr)
+                outputs[cat + "_" + dat]["array"].dump(full_arr)
+                outputs[cat + "_" + dat]["weights"].dump(weights_arr)
+                if self.systematics:
+                    outputs[cat + "_" + dat]["systematics"].dump(np.concatenate(systematics_list))
+        if self.virtual_merge:
+            # only the paths, the rows are read from the headers
+            for path, paths in merges:
+                write_virtual(path, paths)
+        else:
+            merge_parallel(merges, workers=self.workers)
+        self.write_manifest()
+
+
+class SystematicTemplates(CoffeaTask):
+    """
+    nominal and shifted histograms of every variable, from the merged arrays and their systematics matrix
+    """
+
+    channel = luigi.ListParameter(default=["Muon", "Electron"])
+
+    def requires(self):
+        return MergeArrays.req(self, systematics=True)
+
+    def output(self):
+        return self.local_target("templates.coffea")
+
+    @law.decorator.timeit(publish_message=True)
+    @law.decorator.safe_output
+    def run(self):
+        var_names = self.config_inst.variables.names()
+        templates = {}
+        for key, targets in tqdm(self.input().items()):
+            # one read of the columns, weights and shifted weights gives all templates of this category and dataset
+            columns = load_columns(targets, list(var_names) + ["weights"], var_names)
+            systematics = np.asarray(load_systematics(targets))
+            templates[key] = {}
+            for var in self.config_inst.variables:
+                name = var.name.split("_")[0] if var.x_discrete else var.name
+                nominal, shifted = shifted_templates(columns[name], columns["weights"], systematics, var.bin_edges)
+                templates[key][var.name] = dict(shifted, nominal=nominal, edges=np.asarray(var.bin_edges))
+        self.output().dump(templates)
+        self.write_manifest()
 
 
 class ComputeEfficiencies(CoffeaTask):
@@ -137,19 +210,18 @@ class ComputeEfficiencies(CoffeaTask):
     @law.decorator.safe_output
     def run(self):
         dataset_dict = self.input()["initial"]["dataset_dict"].load()
-        dataset_path = self.input()["initial"]["dataset_path"].load()
+        file_index = FileIndex(self.input()["initial"]["file_index"].path)
         total_count_dict = {}
         cut_count_dict = {}
         for key in dataset_dict.keys():
             tot_counts = 0
             cut_counts = 0
-            for fname in dataset_dict[key]:
-                with up.open(dataset_path + "/" + fname) as file:
-                    values = file["cutflow_{}".format(self.channel)].values()
-                    initial_value = values[0]
-                    last_value = values[np.max(np.nonzero(values))]
-                    tot_counts += initial_value
-                    cut_counts += last_value
+            for row in file_index.dataset_rows(key):
+                values = np.array(row["cutflows"]["cutflow_{}".format(self.channel)])
+                initial_value = values[0]
+                last_value = values[np.max(np.nonzero(values))]
+                tot_counts += initial_value
+                cut_counts += last_value
             total_count_dict.update({key: tot_counts})
             cut_count_dict.update({key: cut_counts})
         print(total_count_dict)
@@ -186,7 +258,7 @@ class YieldsFromArrays(CoffeaTask):
     @law.decorator.safe_output
     def run(self):
         # np_0b = self.input()["No_cuts"].load()
-        np_0b = self.input()["No_cuts"].load()
+        np_0b = open_array(self.input()["No_cuts"])
 
         var_names = self.config_inst.variables.names()
         print(var_names)
@@ -216,14 +288,18 @@ class YieldsFromArrays(CoffeaTask):
         ]
 
         yields = {}
+        # cumulative yields need every single cut, so the cuts are applied one by one
+        cuts = CompiledCuts([Cut.from_tuple(cut) for cut in cut_list], backend=self.cut_backend)
+        columns = ArrayColumns(np_0b, var_names)
         mask = np.full(len(np_0b), True)
         print("\nEntry point:", len(np_0b))
-        for cut in cut_list:
-            yiel = eval("np.sum(np_0b[:, var_names.index('{0}')] {1})".format(cut[0], cut[1]))
-            mask = mask & eval("np_0b[:, var_names.index('{0}')] {1}".format(cut[0], cut[1]))
+        for cut, cut_mask in cuts.masks(columns).items():
+            yiel = np.sum(cut_mask)
+            mask = mask & cut_mask
             ratio = np.round(np.sum(mask) / len(np_0b), 3)
-            print(" ".join(cut), ":", yiel, np.sum(mask), ratio)
-            yields.update({" ".join(cut): [float(yiel), float(np.sum(mask)), float(ratio)]})
+            print(cut, ":", yiel, np.sum(mask), ratio)
+            yields.update({cut: [float(yiel), float(np.sum(mask)), float(ratio)]})
 
-        print("Remaining events:", np.sum(mask), "\n")
+        # the remaining events from the fused mask of all cuts
+        print("Remaining events:", np.sum(cuts(columns)), "\n")
         self.output().dump(yields)
@@ -2,8 +2,11 @@ import os
 import law
 import uproot as up
 import numpy as np
-from luigi import Parameter, BoolParameter
+from luigi import Parameter, BoolParameter, IntParameter
 from tasks.base import *
+from utils.file_index import FileIndex
+from utils.scanner import DatasetScanner
+import hashlib
 import json
 
 """
@@ -15,6 +18,17 @@ Then write a fileset directory as an input for coffea
 class BaseMakeFilesTask(AnalysisTask):
     # Basis class only for inheritance
     directory_path = Parameter(default="/nfs/dust/cms/user/frengelk/Code/cmssw/CMSSW_12_1_0/Batch/2023_01_18/2017/Data/root")
+    scan_workers = IntParameter(default=8, significant=False, description="threads listing the dataset directories and reading file metadata, default: 8")
+
+    def scan_cache_path(self, ext=".json"):
+        # shared by all versions, so a new version only lists directories that changed
+        name = hashlib.md5(self.directory_path.encode()).hexdigest()[:10] + ext
+        return os.path.join(os.path.dirname(os.path.dirname(self.local_path())), "DatasetScanner", name)
+
+    def scan_datasets(self):
+        # dataset -> files and the job number of every file
+        scanner = DatasetScanner(self.directory_path, self.scan_cache_path(), workers=self.scan_workers)
+        return scanner.scan(), scanner.job_numbers
 
 
 class WriteDatasets(BaseMakeFilesTask):
@@ -24,17 +38,11 @@ class WriteDatasets(BaseMakeFilesTask):
     def run(self):
         self.output().parent.touch()
 
-        file_dict = {}
-        for root, dirs, files in os.walk(self.directory_path):
-            for directory in dirs:
-                # print(directory)
-                file_list = []
-                for r, d, f in os.walk(self.directory_path + "/" + directory):
-                    for file in f:
-                        file_list.append(directory + "/" + file)
-                file_dict.update({directory: file_list})  # self.directory_path + "/" +
+        file_dict, job_numbers = self.scan_datasets()
 
         file_dict.update({"directory_path": self.directory_path})  # self.directory_path + "/" +
+        # unpacked jobs are numbered per file, stable when files are added
+        file_dict.update({"job_numbers": job_numbers})
         with open(self.output().path, "w") as out:
             json.dump(file_dict, out)
 
@@ -57,19 +65,16 @@ class WriteDatasetPathDict(BaseMakeFilesTask):
             "dataset_dict": self.local_target("datasets_{}.json".format(self.year)),
             "dataset_path": self.local_target("path.json"),  # save this so you'll find the files
             "job_number_dict": self.local_target("job_number_dict.json"),
+            # metadata, entries and cutflows of every file, so later tasks don't reopen them
+            "file_index": self.local_target("file_index.sqlite"),
         }
 
     def run(self):
         self.output()["dataset_dict"].parent.touch()
-        file_dict = {}
-        for root, dirs, files in os.walk(self.directory_path):
-            for directory in dirs:
-                # print(directory)
-                file_list = []
-                for r, d, f in os.walk(self.directory_path + "/" + directory):
-                    for file in f:
-                        file_list.append(directory + "/" + file)
-                file_dict.update({directory: file_list})  # self.directory_path + "/" +
+        # the scan of WriteDatasets, same directory
+        file_dict = self.input().load()
+        file_dict.pop("directory_path")
+        file_dict.pop("job_numbers", None)
         assert len(file_dict.keys()) > 0, "No files found in {}".format(self.directory_path)
         job_number_dict = {}
         for k in sorted(file_dict.keys()):
@@ -78,6 +83,8 @@ class WriteDatasetPathDict(BaseMakeFilesTask):
         self.output()["dataset_dict"].dump(file_dict)
         self.output()["dataset_path"].dump(self.directory_path)
         self.output()["job_number_dict"].dump(job_number_dict)
+        # only new or changed files are opened
+        FileIndex.build(self.output()["file_index"].path, self.directory_path, file_dict, cache_path=self.scan_cache_path(".sqlite"), workers=self.scan_workers)
 
 
 class WriteConfigData(BaseMakeFilesTask):
@@ -172,31 +179,18 @@ class CollectInputData(BaseMakeFilesTask):
 
     @law.decorator.safe_output
     def run(self):
-        sum_gen_weights_dict = {}
         cutflow_dict = {
             "Muon": {},
             "Electron": {},
         }
         # sum weights same for both trees, do it once
         inp = self.input()  # [self.channel[0]].collection.targets[0]
-        data_path = inp["dataset_path"].load()
         dataset_dict = inp["dataset_dict"].load()
+        file_index = FileIndex(inp["file_index"].path)
+        sum_gen_weights_dict = file_index.sum_gen_weights()
         for key in dataset_dict.keys():
-            for path in dataset_dict[key]:
-                with up.open(data_path + "/" + path) as file:
-                    sum_gen_weight = float(np.sum(file["MetaData;1"]["SumGenWeight"].array()))
-                    # keys should do the same for both dicts
-                    if key not in sum_gen_weights_dict.keys():
-                        # cutflow_dict["Muon"][key] = file['cutflow_Muon;1'].values()
-                        # cutflow_dict["Electron"][key] = file['cutflow_Electron;1'].values()
-                        muon_arr = file["cutflow_Muon;1"].values()
-                        electron_arr = file["cutflow_Electron;1"].values()
-                        sum_gen_weights_dict[key] = sum_gen_weight
-                    elif key in sum_gen_weights_dict.keys():
-                        sum_gen_weights_dict[key] += sum_gen_weight
-                        muon_arr += file["cutflow_Muon;1"].values()
-                        electron_arr += file["cutflow_Electron;1"].values()
-
+            muon_arr = file_index.cutflow(key, "cutflow_Muon")
+            electron_arr = file_index.cutflow(key, "cutflow_Electron")
             cutflow_dict["Muon"][key] = muon_arr[muon_arr > 0].tolist()
             cutflow_dict["Electron"][key] = electron_arr[electron_arr > 0].tolist()
 
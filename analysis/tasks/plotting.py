@@ -23,6 +23,7 @@ from tasks.grouping import GroupCoffea, MergeArrays  # , SumGenWeights
 from tasks.arraypreparation import ArrayNormalisation
 from tasks.multiclass import PytorchMulticlass
 from tasks.base import HTCondorWorkflow, DNNTask
+from utils.columnar import load_columns
 
 import utils.pytorch_base as util
 
@@ -39,19 +40,12 @@ class ArrayPlotting(CoffeaTask):  # , HTCondorWorkflow, law.LocalWorkflow):
 
     def requires(self):
         if self.debug:
-            return {sel: CoffeaProcessor.req(self, debug=True, workflow="local") for sel in self.channel}
+            return self.coffea_requires(self.channel, debug=True, workflow="local")
 
         if self.merged:
             return {"merged": MergeArrays.req(self)}
 
-        return {
-            sel: CoffeaProcessor.req(
-                self,
-                lepton_selection=sel,
-                # workflow="local",
-            )
-            for sel in self.channel
-        }
+        return self.coffea_requires(self.channel)
 
     def output(self):
         if self.merged:
@@ -117,16 +111,24 @@ class ArrayPlotting(CoffeaTask):  # , HTCondorWorkflow, law.LocalWorkflow):
             if var.x_discrete:
                 ind = var_names.index(var.name.split("_")[0])
 
+            # reads only the plotted column, from npy or parquet outputs
+            def column(targets):
+                return load_columns(targets, [var_names[ind]], var_names)[var_names[ind]]
+
+            def weights(targets):
+                return load_columns(targets, ["weights"], var_names)["weights"]
+
             # iterating over lepton keys
-            for lep in self.input().keys():
+            inputs = self.input() if self.merged else self.coffea_targets(self.input(), self.channel)
+            for lep in inputs.keys():
                 # accessing the input and unpacking the condor submission structure
                 if self.merged:
-                    np_dict = self.input()[lep]
+                    np_dict = inputs[lep]
                 else:
                     np_dict = {}
-                    for key in self.input()[lep]["collection"].targets[0].keys():
+                    for key in inputs[lep].keys():
                         # for key in self.input()[lep].keys():
-                        np_dict.update({key: self.input()[lep]["collection"].targets[0][key]})
+                        np_dict.update({key: inputs[lep][key]})
                         # np_dict.update({key: self.input()[lep][key]})
                 for cat in self.config_inst.categories.names():
                     sumOfHists = []
@@ -159,19 +161,19 @@ class ArrayPlotting(CoffeaTask):  # , HTCondorWorkflow, law.LocalWorkflow):
                         # this will only be true for merged
                         if key in np_dict.keys():
                             if proc.aux["isData"] and self.unblinded:
-                                data_boost_hist.fill(np_dict[key]["array"].load()[:, ind])
+                                data_boost_hist.fill(column(np_dict[key]))
                                 # np.load(value["array"].path)  # , weight=np.load(value["weights"].path))
                             elif proc.aux["isSignal"] and self.signal:
-                                signal_boost_hist.fill(np_dict[key]["array"].load()[:, ind])
+                                signal_boost_hist.fill(column(np_dict[key]))
                             elif not proc.aux["isData"] and not proc.aux["isSignal"]:
-                                boost_hist.fill(np_dict[key]["array"].load()[:, ind], weight=np_dict[key]["weights"].load())
+                                boost_hist.fill(column(np_dict[key]), weight=weights(np_dict[key]))
                         if not self.merged:
                             for pro in self.get_proc_list([dat]):
                                 boost_hist = bh.Histogram(self.construct_axis(var.binning, not var.x_discrete))
                                 k = cat + "_" + pro
                                 for key in np_dict.keys():
                                     if k in key:
-                                        boost_hist.fill(np_dict[key]["array"].load()[:, ind], weight=np_dict[key]["weights"].load())
+                                        boost_hist.fill(column(np_dict[key]), weight=weights(np_dict[key]))
                                 hep.histplot(boost_hist, label=k, histtype="step", ax=ax)
 
                         if self.divide_by_binwidth:
@@ -277,6 +279,7 @@ class ArrayPlotting(CoffeaTask):  # , HTCondorWorkflow, law.LocalWorkflow):
                         plt.savefig(self.output()[outputKey]["log"].path, bbox_inches="tight")
                     plt.gcf().clear()
                     plt.close(fig)
+        self.write_manifest()
 
 
 class StitchingPlot(CoffeaTask):
@@ -289,12 +292,7 @@ class StitchingPlot(CoffeaTask):
     def requires(self):
         return {
             "merged": MergeArrays.req(self, channel=self.channel, datasets_to_process=self.datasets_to_process),
-            "base": CoffeaProcessor.req(
-                self,
-                lepton_selection=self.channel[0],
-                datasets_to_process=self.datasets_to_process,
-                # workflow="local"
-            ),
+            "base": self.coffea_requires(self.channel[:1], datasets_to_process=self.datasets_to_process),
         }
 
     def output(self):
@@ -312,7 +310,7 @@ class StitchingPlot(CoffeaTask):
         merged = self.input()["merged"]
         base = self.input()["base"]
         var = self.config_inst.get_variable("HT")
-        inp_dict = self.input()["base"]["collection"].targets[0]
+        inp_dict = self.coffea_targets(self.input()["base"], self.channel[:1])[self.channel[0]]
 
         for dat in tqdm(self.datasets_to_process, unit="dataset"):
             base_dict = {}
@@ -328,8 +326,9 @@ class StitchingPlot(CoffeaTask):
                 for pro in proc_list:
                     if pro in key:
                         k = "_".join(key.split("_")[1:-1])
-                        base_dict[k]["array"] = np.append(base_dict[k]["array"], inp_dict[key]["array"].load()[:, var_names.index(var.name)])
-                        base_dict[k]["weights"] = np.append(base_dict[k]["weights"], inp_dict[key]["weights"].load())
+                        columns = load_columns(inp_dict[key], [var.name, "weights"], var_names)
+                        base_dict[k]["array"] = np.append(base_dict[k]["array"], columns[var.name])
+                        base_dict[k]["weights"] = np.append(base_dict[k]["weights"], columns["weights"])
 
             fig, ax = plt.subplots(figsize=(12, 10))
             hep.cms.text("Private work (CMS simulation)", loc=0, ax=ax)
@@ -358,7 +357,8 @@ class StitchingPlot(CoffeaTask):
             proc = self.config_inst.get_process(pro.split("_")[1])
 
             merged_boost_hist = bh.Histogram(self.construct_axis(var.binning, not var.x_discrete))
-            merged_boost_hist.fill(merged[pro]["array"].load()[:, var_names.index(var.name)], weight=merged[pro]["weights"].load())
+            merged_columns = load_columns(merged[pro], [var.name, "weights"], var_names)
+            merged_boost_hist.fill(merged_columns[var.name], weight=merged_columns["weights"])
             hep.histplot(merged_boost_hist, label=proc.label, histtype="step", ax=ax, linewidth=2)
 
             ax.set_ylabel(var.get_full_y_title())
@@ -376,6 +376,7 @@ class StitchingPlot(CoffeaTask):
                 plt.savefig(self.output()[dat + ending].path, bbox_inches="tight")
             plt.gcf().clear()
             plt.close(fig)
+        self.write_manifest()
 
 
 class CutflowPlotting(CoffeaTask):
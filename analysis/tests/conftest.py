@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules are imported relative to the analysis directory, as with PYTHONPATH from setup.sh
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,104 @@
+import ast
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+from utils.cuts import ArrayColumns, CompiledCuts, Cut, CutflowBits, RegionBinning
+
+var_names = ["LT", "HT", "nJets", "iso_cut"]
+cut_list = [("iso_cut", "cut"), ("LT", ">350"), ("HT", ">500"), ("nJets", ">=3")]
+
+
+@pytest.fixture
+def columns():
+    rng = np.random.default_rng(2)
+    array = rng.uniform(0, 1000, (2000, len(var_names))).astype(np.float32)
+    array[:, 2] = rng.integers(0, 8, len(array))
+    array[:, 3] = rng.integers(0, 2, len(array))
+    # exact thresholds
+    array[:10, 0], array[10:20, 1], array[20:30, 2] = 350, 500, 3
+    return ArrayColumns(array, var_names)
+
+
+@pytest.mark.parametrize("backend", CompiledCuts.backends)
+def test_fused_mask_matches_single_cuts(columns, backend):
+    if backend != "numpy" and importlib.util.find_spec(backend) is None:
+        pytest.skip("{} is not installed".format(backend))
+    cuts = CompiledCuts([Cut.from_tuple(cut) for cut in cut_list], backend=backend)
+    expected = np.logical_and.reduce([np.asarray(mask, dtype=bool) for mask in cuts.masks(columns).values()])
+    np.testing.assert_array_equal(np.asarray(cuts(columns), dtype=bool), expected)
+
+
+def test_no_cuts():
+    assert CompiledCuts([])(None) is True
+
+
+def loop_cutflow(masks, weights):
+    # cumulative and N-1 yields as filled cut by cut before the bitmask
+    cutflow, n_minus1 = [weights.sum()], [weights.sum()]
+    for i in range(len(masks)):
+        cutflow.append(weights[np.logical_and.reduce([np.ones(len(weights), dtype=bool)] + masks[: i + 1])].sum())
+        n_minus1.append(weights[np.logical_and.reduce([np.ones(len(weights), dtype=bool)] + masks[:i] + masks[i + 1 :])].sum())
+    return np.array(cutflow), np.array(n_minus1)
+
+
+@pytest.mark.parametrize("n_cuts", [0, 1, 5, 32])
+def test_cutflow_bits_match_loop(n_cuts):
+    rng = np.random.default_rng(n_cuts)
+    weights = rng.uniform(0, 2, 3000)
+    masks = [rng.uniform(size=len(weights)) < 0.9 for _ in range(n_cuts)]
+    bits = CutflowBits(masks, size=len(weights))
+    cutflow, n_minus1 = loop_cutflow(masks, weights)
+    np.testing.assert_allclose(bits.cutflow(weights), cutflow)
+    np.testing.assert_allclose(bits.n_minus1(weights), n_minus1)
+
+
+def test_cutflow_bits_without_cuts_need_size():
+    with pytest.raises(ValueError):
+        CutflowBits([])
+
+
+def signal_regions():
+    # the region strings of utils/signal_regions.py, read without importing its task dependencies
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils", "signal_regions.py")
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "signal_regions_0b":
+            return ast.literal_eval(node.value)
+
+
+def test_region_binning_matches_region_masks():
+    regions = signal_regions()
+    binning = RegionBinning.from_regions(regions)
+    rng = np.random.default_rng(4)
+    size = 20000
+    columns = {}
+    for var in ["LT", "HT", "Dphi"]:
+        # half of the values exactly on a threshold of some region, the others anywhere around them
+        edges = binning.edges[var]
+        spread = edges[-1] - edges[0] + 1
+        values = np.where(rng.uniform(size=size) < 0.5, rng.choice(edges, size), rng.uniform(edges[0] - spread / 2, edges[-1] + spread / 2, size))
+        values[rng.uniform(size=size) < 0.02] = np.nan
+        columns[var] = values.astype(np.float32)
+    # compact exports store the jet multiplicity as int8
+    columns["n_jets"] = rng.integers(2, 12, size).astype(np.int8)
+    weights = rng.uniform(0, 2, size)
+
+    expected = np.full(size, -1)
+    for i, conditions in enumerate(regions.values()):
+        inside = np.logical_and.reduce([np.asarray(mask, dtype=bool) for mask in CompiledCuts.from_region(conditions).masks(columns).values()])
+        assert not np.any(inside & (expected >= 0))
+        expected[inside] = i
+    assert np.sum(expected >= 0) > 100
+    np.testing.assert_array_equal(binning.region_ids(columns), expected)
+
+    counts, sumw, sumw2 = binning.yields(columns, weights)
+    np.testing.assert_array_equal(counts, np.bincount(expected[expected >= 0], minlength=len(regions)))
+    np.testing.assert_allclose(sumw, [weights[expected == i].sum() for i in range(len(regions))])
+    np.testing.assert_allclose(sumw2, [(weights[expected == i] ** 2).sum() for i in range(len(regions))])
+    # every event in a region passes the common lower bounds
+    for var, op, value in binning.lower_bounds():
+        assert np.all(columns[var][expected >= 0] >= value)
@@ -0,0 +1,28 @@
+import awkward as ak
+import numpy as np
+
+from utils.jagged import jagged_buffers, leading_objects
+
+
+def reference(values, n, fill):
+    return ak.to_numpy(ak.fill_none(ak.pad_none(values, n, clip=True), fill)).astype(np.float32)
+
+
+def test_leading_objects_match_padding():
+    rng = np.random.default_rng(3)
+    counts = rng.integers(0, 5, 500)
+    pt = ak.unflatten(rng.uniform(0, 100, counts.sum()).astype(np.float32), counts)
+    eta = ak.unflatten(rng.uniform(-2.4, 2.4, counts.sum()), counts)
+    # a sliced and a masked collection, the offsets do not start at 0 or the content is filtered
+    for branches in [{"pt": pt, "eta": eta}, {"pt": pt[100:], "eta": eta[100:]}, {"pt": pt[pt > 50], "eta": eta[pt > 50]}]:
+        out = leading_objects(branches, 2, -999)
+        for name, values in branches.items():
+            np.testing.assert_array_equal(out[name], reference(values, 2, -999))
+
+
+def test_buffers_are_views():
+    content = np.arange(6, dtype=np.float32)
+    values = ak.unflatten(content, [2, 0, 4])
+    offsets, buffer = jagged_buffers(values[1:])
+    assert list(offsets) == [2, 2, 6]
+    assert np.shares_memory(buffer, content)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from utils.merging import VirtualArray, materialize_parallel, merge_into, plan_segments, reduce_histograms, write_virtual
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    # an empty job written with a different layout than the job with events, as the placeholder of a job without events used to be
+    empty, full = str(tmp_path / "empty.npy"), str(tmp_path / "full.npy")
+    np.save(empty, np.zeros((0, 24), dtype=np.float64))
+    np.save(full, np.arange(12, dtype=np.float32).reshape(4, 3))
+    return empty, full
+
+
+def test_plan_segments_skips_empty(jobs):
+    segments, dtype, inner_shape, rows = plan_segments(jobs)
+    assert dtype == np.float32
+    assert tuple(inner_shape) == (3,)
+    assert rows == 4
+    assert [segment["rows"] for segment in segments] == [0, 4]
+
+
+def test_merge_empty_and_full(jobs, tmp_path):
+    path = str(tmp_path / "merged.npy")
+    assert merge_into(path, jobs) == 4
+    merged = np.load(path)
+    assert merged.dtype == np.float32
+    np.testing.assert_array_equal(merged, np.load(jobs[1]))
+
+
+def test_virtual_empty_and_full(jobs, tmp_path):
+    path = str(tmp_path / "merged.json")
+    write_virtual(path, list(reversed(jobs)) + [jobs[0]])
+    array = VirtualArray.load(path)
+    assert array.shape == (4, 3)
+    np.testing.assert_array_equal(np.asarray(array), np.load(jobs[1]))
+    np.testing.assert_array_equal(array[1:3, 0], np.load(jobs[1])[1:3, 0])
+
+
+def test_only_empty_jobs(tmp_path):
+    path = str(tmp_path / "empty.npy")
+    np.save(path, np.zeros((0, 3), dtype=np.float32))
+    merged = str(tmp_path / "merged.npy")
+    assert merge_into(merged, [path, path]) == 0
+    assert np.load(merged).shape == (0, 3)
+
+
+def test_mismatch_raises(jobs, tmp_path):
+    other = str(tmp_path / "other.npy")
+    np.save(other, np.zeros((2, 5), dtype=np.float32))
+    with pytest.raises(ValueError):
+        plan_segments([jobs[1], other])
+
+
+def test_reduce_nothing():
+    assert reduce_histograms([]) is None
+    assert reduce_histograms([], workers=4) is None
+
+
+def test_materialize_parallel(jobs, tmp_path):
+    manifest, path = str(tmp_path / "merged.json"), str(tmp_path / "merged.npy")
+    write_virtual(manifest, [jobs[1], jobs[0], jobs[1]])
+    assert materialize_parallel([(manifest, path)], workers=2) == [8]
+    np.testing.assert_array_equal(np.load(path), np.asarray(VirtualArray.load(manifest)))
@@ -0,0 +1,30 @@
+import os
+
+from utils.scanner import DatasetScanner
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def test_job_numbers_are_stable(tmp_path):
+    data, cache = str(tmp_path / "data"), str(tmp_path / "cache" / "scan.json")
+    for name in ["A/1.root", "A/2.root", "B/1.root", "C/1.root"]:
+        touch(os.path.join(data, name))
+    scanner = DatasetScanner(data, cache)
+    scanner.scan()
+    before = dict(scanner.job_numbers)
+    assert sorted(before.values()) == [0, 1, 2, 3]
+    # a new file in the first dataset and a removed one in the last
+    touch(os.path.join(data, "A/0.root"))
+    os.remove(os.path.join(data, "C/1.root"))
+    # the directory mtime has to change for the listing to be refreshed
+    os.utime(os.path.join(data, "A"), (1, 1))
+    os.utime(os.path.join(data, "C"), (1, 1))
+    scanner = DatasetScanner(data, cache)
+    file_dict = scanner.scan()
+    assert file_dict["A"] == ["A/1.root", "A/2.root", "A/0.root"]
+    assert {name: number for name, number in scanner.job_numbers.items() if name in before} == {name: number for name, number in before.items() if name != "C/1.root"}
+    # the number of the removed file is not given to the new one
+    assert scanner.job_numbers["A/0.root"] == 4
@@ -0,0 +1,18 @@
+import numpy as np
+
+from utils.systematics import shifted_templates, variations
+
+
+def test_shifted_templates_match_histograms():
+    rng = np.random.default_rng(1)
+    values = np.concatenate([rng.uniform(-1, 11, 1000), [0.0, 10.0, np.nan]])
+    nominal = rng.uniform(0.5, 1.5, len(values))
+    systematics = nominal[:, None] * rng.uniform(0.9, 1.1, (len(values), len(variations)))
+    edges = np.linspace(0, 10, 11)
+    counts, shifted = shifted_templates(values, nominal, systematics, edges)
+    # the last edge is open in the templates, np.histogram closes it, so the comparison leaves it out
+    inside = values < edges[-1]
+    np.testing.assert_allclose(counts, np.histogram(values[inside], edges, weights=nominal[inside])[0])
+    assert list(shifted) == variations
+    for i, name in enumerate(variations):
+        np.testing.assert_allclose(shifted[name], np.histogram(values[inside], edges, weights=systematics[inside, i])[0])
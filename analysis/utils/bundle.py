@@ -0,0 +1,75 @@
+"""
+Single file output of a CoffeaProcessor branch
+All categories' arrays, weights and systematics and the cutflow histograms of a
+branch are members of one npz file, the histograms are stored once per branch
+The reader hands out members with a load() method, so they can be used in place
+of the per category targets
+"""
+
+import pickle
+
+import numpy as np
+
+# members of a category are stored as <category>/<key>, histograms as pickled bytes
+histogram_keys = ["cutflow", "n_minus1"]
+
+
+def member_name(category, key):
+    return category + "/" + key
+
+
+def write_bundle(path, arrays, histograms, masspoints=None):
+    """
+    arrays: category -> key -> array, histograms: name -> histogram,
+    masspoints: category -> mass point -> key -> array
+    """
+    content = {member_name(cat, key): array for cat, cat_arrays in arrays.items() for key, array in cat_arrays.items()}
+    content.update({name: np.frombuffer(pickle.dumps(hist, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8) for name, hist in histograms.items()})
+    for cat, points in (masspoints or {}).items():
+        for name, point_arrays in points.items():
+            content.update({member_name(cat, "masspoints/" + name + "_" + key): array for key, array in point_arrays.items()})
+    with open(path, "wb") as f:
+        np.savez(f, **content)
+
+
+class BundleMember:
+    """
+    one array or histogram of a bundle, read on load()
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def __repr__(self):
+        return "BundleMember({}, {})".format(self.path, self.name)
+
+    def load(self):
+        with np.load(self.path) as f:
+            value = f[self.name]
+        if self.name in histogram_keys:
+            return pickle.loads(value.tobytes())
+        return value
+
+
+class BundleMasspoints(BundleMember):
+    # the mass point members of a category, loaded like the separate npz output
+    def load(self):
+        prefix = member_name(self.name, "masspoints/")
+        with np.load(self.path) as f:
+            return {name[len(prefix) :]: f[name] for name in f.files if name.startswith(prefix)}
+
+
+def bundle_targets(path, categories, keys, masspoints=False):
+    """
+    category -> key -> member of one bundle, laid out like the per category targets of the npy output
+    keys are the array keys, e.g. array, weights and systematics, the file is only opened on load()
+    """
+    out = {}
+    for cat in categories:
+        members = {key: BundleMember(path, member_name(cat, key)) for key in keys}
+        members.update({name: BundleMember(path, name) for name in histogram_keys})
+        if masspoints:
+            members["masspoints"] = BundleMasspoints(path, cat)
+        out[cat] = members
+    return out
@@ -4,12 +4,17 @@ Here we apply our selection and define the categories used for the analysis
 Also this write our arrays
 """
 
+import hashlib
+import os
+import uuid
+from collections import ChainMap
+
 import coffea
 import numpy as np
 import uproot as up
 import awkward as ak
 from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
-from coffea import hist, processor
+from coffea import hist, processor, util
 from coffea.hist.hist_tools import DenseAxis, Hist
 import boost_histogram as bh
 
@@ -21,6 +26,14 @@ from coffea.processor.accumulator import (
 )
 from coffea.processor.executor import WorkQueueExecutor
 
+from utils.columns import ColumnResolver
+from utils.cuts import CompiledCuts, CutflowBits, EventColumns
+from utils.producers import registry
+from utils.systematics import WeightShifts
+from utils.masspoints import MasspointGroups, scan_datasets
+from utils.columnar import compact_array, storage_dtypes
+from utils.streaming import NpyAppender
+
 # register our candidate behaviors
 # from coffea.nanoevents.methods import candidate
 # ak.behavior.update(candidate.behavior)
@@ -35,6 +48,16 @@ class BaseProcessor(processor.ProcessorABC):
     def __init__(self, task):
         # self.publish_message = task.publish_message if task.debug else None
         self.config = task.config_inst
+        # dual tree processors see chunks of both lepton trees and key their output by tree name
+        self.dual_tree = task.dual_tree
+        # split SMS scans by mass point instead of keeping only the configured one
+        self.demultiplex = task.demultiplex_masspoints
+        self.compact_dtypes = task.compact_dtypes
+        trees = task.lepton_trees if self.dual_tree else [task.lepton_selection]
+        # which derived quantities and branches are needed per tree
+        self.column_resolvers = {tree: ColumnResolver(self.config, tree) for tree in trees}
+        # category cuts are parsed once instead of eval per chunk
+        self.category_cuts = {cat.name: CompiledCuts.from_category(cat, backend=task.cut_backend) for cat in self.config.categories}
         # self.corrections = task.load_corrections()
         self.dataset_axis = hist.Cat("dataset", "Primary dataset")
         # self.dataset_shift_axis = hist.Cat("dataset_shift", "Dataset shift")
@@ -43,6 +66,7 @@ class BaseProcessor(processor.ProcessorABC):
         self._accumulator = dict_accumulator(
             n_events=defaultdict_accumulator(int),
             sum_gen_weights=defaultdict_accumulator(float),
+            masspoint_sum_gen_weights=defaultdict_accumulator(float),
             object_cutflow=defaultdict_accumulator(int),
             # cutflow = bh.Histogram(bh.axis.Regular(20, 0, 20)),
             cutflow=hist.Hist("Counts", self.dataset_axis, self.category_axis, self.category_axis, hist.Bin("cutflow", "Cut", 20, 0, 20)),
@@ -93,37 +117,37 @@ class BaseSelection:
         pass
 
     def get_selection_as_np(self, X):
+        # compact exports keep the storage dtype declared per variable
+        if self.compact_dtypes:
+            return dict(hl=compact_array({var: ak.to_numpy(X[var]) for var in self.config.variables.names()}, storage_dtypes(self.config.variables)))
         return dict(hl=np.stack([ak.to_numpy(X[var]).astype(np.float32) for var in self.config.variables.names()], axis=-1))
 
+    # the single cuts are only packed into the selection for processors filling cutflows
+    keep_cut_masks = True
+
     def add_to_selection(self, selection, name, array):
         return selection.add(name, ak.to_numpy(array, allow_missing=True))
 
-    def get_base_variable(self, events):
-        ntFatJets = ak.fill_none(ak.firsts(events.FatJetDeepTagTvsQCD), value=-999)
-        nWFatJets = ak.fill_none(ak.firsts(events.FatJetDeepTagWvsQCD), value=-999)
-        jetMass_1 = ak.fill_none(ak.firsts(events.JetMass[:, 0:1]), value=-999)
-        jetPt_1 = ak.fill_none(ak.firsts(events.JetPt[:, 0:1]), value=-999)
-        jetEta_1 = ak.fill_none(ak.firsts(events.JetEta[:, 0:1]), value=-999)
-        jetPhi_1 = ak.fill_none(ak.firsts(events.JetPhi[:, 0:1]), value=-999)
-        jetMass_2 = ak.fill_none(ak.firsts(events.JetMass[:, 1:2]), value=-999)
-        jetPt_2 = ak.fill_none(ak.firsts(events.JetPt[:, 1:2]), value=-999)
-        jetEta_2 = ak.fill_none(ak.firsts(events.JetEta[:, 1:2]), value=-999)
-        jetPhi_2 = ak.fill_none(ak.firsts(events.JetPhi[:, 1:2]), value=-999)
-        nJets = events.nJet
-        LT = events.LT
-        HT = events.HT
-        metPt = events.MetPt
-        WBosonMt = events.WBosonMt
-        dPhi = events.DeltaPhi
-        nbJets = events.nDeepJetMediumBTag
-        # name with underscores lead to problems
-        zerob = nbJets == 0
-        multib = nbJets >= 1
-        # variables to check cuts
-        correctedMetPt = events.CorrectedMetPt
-        isoTrackPt = ak.fill_none(ak.firsts(events.IsoTrackPt), value=-999)
-        isoTrackMt2 = ak.fill_none(ak.firsts(events.IsoTrackMt2), value=-999)
-        return locals()
+    def fused_mask(self, cuts, columns, size):
+        # all cuts of a category in one call, the numpy backend gives True if there are no cuts
+        mask = cuts(columns)
+        if mask is True:
+            return np.ones(size, dtype=bool)
+        return np.asarray(ak.to_numpy(mask, allow_missing=True), dtype=bool)
+
+    def tree_output(self, events, output):
+        # dual tree processors accumulate both trees side by side
+        return dict_accumulator({events.metadata["treename"]: output}) if self.dual_tree else output
+
+    def fill_cutflows(self, output, selected_output):
+        # cutflow and N-1 yields of all categories from one bitmask per category, weights are computed once
+        weight = selected_output["weights"].weight()
+        selection = selected_output["selection"]
+        for cat, cuts in selected_output["categories"].items():
+            bits = CutflowBits([selection.all(cut) for cut in cuts], size=len(weight))
+            steps = np.arange(len(cuts) + 1)
+            output["cutflow"].fill(dataset=selected_output["dataset"], category=cat, cutflow=steps, weight=bits.cutflow(weight))
+            output["n_minus1"].fill(dataset=selected_output["dataset"], category=cat, cutflow=steps, weight=bits.n_minus1(weight))
 
     def get_gen_variable(self, events):
         genMetPt = events.GenMetPt
@@ -144,32 +168,6 @@ class BaseSelection:
         genMuonEta = events.GenMuonEta_1
         return locals()
 
-    def get_muon_variables(self, events):
-        # leptons variables
-        nMuon = events.nMuon
-        leadMuonPt = ak.fill_none(ak.firsts(events.MuonPt[:, 0:1]), -999)
-        leadMuonEta = ak.fill_none(ak.firsts(events.MuonEta[:, 0:1]), -999)
-        leadMuonPhi = ak.fill_none(ak.firsts(events.MuonPhi[:, 0:1]), -999)
-        # MuonMass
-        muonCharge = events.MuonCharge
-        muonPdgId = events.MuonPdgId
-        # vetoMuon = (events.MuonPt[:, 1:2] > 10) & events.MuonLooseId[:, 1:2]
-
-        return locals()
-
-    def get_electron_variables(self, events):
-        # leptons variables
-        nElectron = events.nElectron
-        leadElectronPt = ak.fill_none(ak.firsts(events.ElectronPt[:, 0:1]), -999)
-        leadElectronEta = ak.fill_none(ak.firsts(events.ElectronEta[:, 0:1]), -999)
-        leadElectronPhi = ak.fill_none(ak.firsts(events.ElectronPhi[:, 0:1]), -999)
-        # ElectronMass
-        electronCharge = events.ElectronCharge
-        electronPdgId = events.ElectronPdgId
-        vetoElectron = (events.ElectronPt[:, 1:2] > 10) & events.ElectronLooseId[:, 1:2]
-
-        return locals()
-
     def base_select(self, events):
         dataset = events.metadata["dataset"]
         # dataset_obj = self.config.get_dataset(dataset)
@@ -185,14 +183,16 @@ class BaseSelection:
             # just filling a 1 for each event
             summary["sum_gen_weights"][dataset] = 1.0
 
-        # Get Variables used for Analysis and Selection
-        locals().update(self.get_base_variable(events))
+        # Get Variables used for Analysis and Selection, only computed when a variable or cut asks for them
+        variables = registry.view(events, context={"proc": proc, "demultiplex": self.demultiplex})
+        # all mass points of a scan are grouped in one pass
+        masspoints = None
+        if self.demultiplex and dataset in scan_datasets:
+            masspoints = MasspointGroups(events.mGluino, events.mNeutralino)
+            for name, sum_gen_weight in masspoints.sums(events.GenWeight).items():
+                summary["masspoint_sum_gen_weights"][name] += sum_gen_weight
         # if events.metadata["isFastSim"]:
         #    locals().update(self.get_gen_variable(events))
-        locals().update(self.get_electron_variables(events))
-        locals().update(self.get_muon_variables(events))
-        sortedJets = ak.mask(events.JetPt, (events.nJet >= 3))
-        goodJets = (events.JetPt > 30) & (abs(events.JetEta) < 2.4)
         # iso_track = ((events.IsoTrackPt > 10) & (((events.IsoTrackMt2 < 60) & events.IsoTrackIsHadronicDecay) | ((events.IsoTrackMt2 < 80) & ~(events.IsoTrackIsHadronicDecay))))
         # iso_track_cut = ak.sum(iso_track, axis=-1) == 0
 
@@ -202,47 +202,8 @@ class BaseSelection:
         # baselineSelection = (sortedJets[:, 1] > 80) & (events.LT > 250) & (events.HT > 500) & (ak.num(goodJets) >= 3) & (~events.IsoTrackVeto)
         # subleading_jet = sortedJets[:, 1] > 80
         # from IPython import embed; embed()
-        subleading_jet = ak.fill_none(ak.firsts(events.JetPt[:, 1:2] > 80), False)
-
-        # doing lep selection
-        mu_pt = ak.fill_none(ak.firsts(events.MuonPt[:, 0:1]), -999)
-        e_pt = ak.fill_none(ak.firsts(events.ElectronPt[:, 0:1]), -999)
-        mu_eta = ak.fill_none(ak.firsts(events.MuonEta[:, 0:1]), -999)
-        e_eta = ak.fill_none(ak.firsts(events.ElectronEta[:, 0:1]), -999)
-        mu_id = ak.fill_none(ak.firsts(events.MuonMediumId[:, 0:1]), False)
-        e_id = ak.fill_none(ak.firsts(events.ElectronTightId[:, 0:1]), False)
-
-        hard_lep = ((mu_pt > 25) | (e_pt > 25)) & ((abs(mu_eta) < 2.4) | (abs(e_eta) < 2.4))
-        selected = (mu_id | e_id) & ((events.nGoodMuon == 1) | (events.nGoodElectron == 1))
-        no_veto_lepton = (events.nVetoMuon - events.nGoodMuon == 0) & (events.nVetoElectron - events.nGoodElectron == 0)
-
-        # njet_cut = ak.num(goodJets) >= 3
-        njet_cut = ak.sum(events.JetIsClean, axis=1) >= 3
-        iso_cut = ~events.IsoTrackVeto
-
-        # stitch ttbar at events.LHE_HTIncoming < 600
-        if events.metadata["dataset"] == "TTToSemiLeptonic_TuneCP5_13TeV-powheg-pythia8" or events.metadata["dataset"] == "TTTo2L2Nu_TuneCP5_13TeV-powheg-pythia8":
-            LHE_HT_cut = events.LHE_HTIncoming < 600
-            # plug it on onto iso_cut, so cutflow is consistent
-            iso_cut = iso_cut & LHE_HT_cut
-
-        if events.metadata["dataset"] == "SMS-T5qqqqVV_TuneCP2_13TeV-madgraphMLM-pythia8":
-            mGlu_cut = events.mGluino == proc.aux["masspoint"][0]
-            mNeu_cut = events.mNeutralino == proc.aux["masspoint"][1]
-            iso_cut = iso_cut & (mGlu_cut) & (mNeu_cut)
-
-        # require correct lepton IDs, applay cut depending on tree name
-        # ElectronIdCut = ak.fill_none(ak.firsts(events.ElectronTightId[:, 0:1]), False)
-        # MuonIdCut = ak.fill_none(ak.firsts(events.MuonMediumId[:, 0:1]), False)
-        # prevent double counting in data
-        doubleCounting_XOR = (not events.metadata["isData"]) | ((events.metadata["PD"] == "isSingleElectron") & events.HLT_EleOr) | ((events.metadata["PD"] == "isSingleMuon") & events.HLT_MuonOr & ~events.HLT_EleOr) | ((events.metadata["PD"] == "isMet") & events.HLT_MetOr & ~events.HLT_MuonOr & ~events.HLT_EleOr)
-        # HLT Combination
-        HLT_Or = (not events.metadata["isData"]) | (events.HLT_MuonOr | events.HLT_MetOr | events.HLT_EleOr)
-        # ghost muon filter
-        ghost_muon_filter = events.MetPt / events.CaloMET_pt <= 5
+
         common = ["baselineSelection", "doubleCounting_XOR", "HLT_Or"]  # , "{}IdCut".format(events.metadata["treename"])]
-        # data cut for control plots
-        data_cut = (events.LT > 250) & (events.HT > 500) & (ak.num(goodJets) >= 3)
         # skim_cut = (events.LT > 150) & (events.HT > 350)
         # triggers = [
         # "HLT_Ele115_CaloIdVT_GsfTrkIdT",
@@ -270,15 +231,17 @@ class BaseSelection:
         # MET_Filter = "HLT_PFMET100_PFMHT100_IDTight | HLT_PFMET110_PFMHT110_IDTight | HLT_PFMET120_PFMHT120_IDTight | HLT_PFMETNoMu100_PFMHTNoMu100_IDTight | HLT_PFMETNoMu110_PFMHTNoMu110_IDTight |HLT_PFMETNoMu120_PFMHTNoMu120_IDTight"
         # METFilter = eval(MET_Filter)        # apply weights,  MC/data check beforehand
         weights = processor.Weights(size, storeIndividual=self.individal_weights)
+        # keeps the relative up and down shifts for the systematics matrix
+        shifts = WeightShifts(weights)
         if not events.metadata["isData"]:
-            weights.add("xSec", events.metadata["xSec"] * 1000)  # account for pb / fb
-            weights.add("Luminosity", events.metadata["Luminosity"])
-            weights.add("GenWeight", events.GenWeight)
-            weights.add("sumGenWeight", 1 / events.metadata["sumGenWeight"])
+            shifts.add("xSec", events.metadata["xSec"] * 1000)  # account for pb / fb
+            shifts.add("Luminosity", events.metadata["Luminosity"])
+            shifts.add("GenWeight", events.GenWeight)
+            shifts.add("sumGenWeight", 1 / events.metadata["sumGenWeight"])
             if events.metadata["treename"] == "Muon":
                 sfs = ["MuonMediumSf", "MuonTriggerSf", "MuonMediumIsoSf"]
                 for sf in sfs:
-                    weights.add(
+                    shifts.add(
                         sf,
                         getattr(events, sf)[:, 0],
                         weightDown=getattr(events, sf + "Down")[:, 0],
@@ -288,7 +251,7 @@ class BaseSelection:
             if events.metadata["treename"] == "Electron":
                 sfs = ["ElectronTightSf", "ElectronRecoSf"]
                 for sf in sfs:
-                    weights.add(
+                    shifts.add(
                         sf,
                         getattr(events, sf)[:, 0],
                         weightDown=getattr(events, sf + "Down")[:, 0],
@@ -302,14 +265,14 @@ class BaseSelection:
             # weightUp=events.nISRWeightDown_Mar17,
             # )
 
-            weights.add(
+            shifts.add(
                 "PileUpWeight",
                 events.PileUpWeight,
                 weightDown=events.PileUpWeightDown,
                 weightUp=events.PileUpWeightUp,
             )
             if not dataset == "SMS-T5qqqqVV_TuneCP2_13TeV-madgraphMLM-pythia8":
-                weights.add(
+                shifts.add(
                     "PreFireWeight",
                     events.PreFireWeight,
                     weightDown=events.PreFireWeightDown,
@@ -326,16 +289,51 @@ class BaseSelection:
             # weightDown= events.JetMediumCSVBTagSFDown,
             # )
 
-        for cat in self.config.categories:
-            for cut in cat.get_aux("cuts"):
-                if cut[1] == "cut":
-                    self.add_to_selection(selection, " ".join(cut), eval(cut[0]))
-                else:
-                    self.add_to_selection(selection, " ".join(cut), eval("events.{} {}".format(cut[0], cut[1])))
+        # boolean cuts are derived quantities, all other cuts act on the branches
+        columns = EventColumns(events, variables)
+        if self.keep_cut_masks:
+            for cat in self.config.categories:
+                for label, mask in self.category_cuts[cat.name].masks(columns).items():
+                    self.add_to_selection(selection, label, mask)
+        # one fused mask per category selects the exported events
+        category_masks = {cat.name: self.fused_mask(self.category_cuts[cat.name], columns, size) for cat in self.config.categories}
 
         # categories = dict(N0b=common + ["zerob"], N1ib=common + ["multib"])  # common +
         categories = {cat.name: [" ".join(cut) for cut in cat.get_aux("cuts")] for cat in self.config.categories}
-        return locals()
+        # the derived quantities stay lazy, the consumers only compute what they look up
+        return ChainMap(locals(), variables)
+
+
+def checkpoint_name(treename, filename, entrystart, entrystop):
+    # one file per chunk, the same name from a WorkItem and from events.metadata
+    return "{}_{}_{}_{}.coffea".format(treename, hashlib.md5(filename.encode()).hexdigest()[:12], entrystart, entrystop)
+
+
+class CheckpointProcessor(processor.ProcessorABC):
+    """
+    wraps a processor and saves the output of every finished chunk to a scratch directory,
+    so an evicted job can pick up where it stopped
+    """
+
+    def __init__(self, processor_inst, scratch_dir):
+        self.processor_inst = processor_inst
+        self.scratch_dir = scratch_dir
+
+    @property
+    def accumulator(self):
+        return self.processor_inst.accumulator
+
+    def process(self, events):
+        output = self.processor_inst.process(events)
+        name = checkpoint_name(events.metadata["treename"], events.metadata["filename"], events.metadata["entrystart"], events.metadata["entrystop"])
+        # write and rename, an eviction during the write never leaves a broken checkpoint
+        path = os.path.join(self.scratch_dir, name)
+        util.save(output, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return output
+
+    def postprocess(self, accumulator):
+        return self.processor_inst.postprocess(accumulator)
 
 
 class ArrayAccumulator(column_accumulator):
@@ -365,25 +363,98 @@ class ArrayAccumulator(column_accumulator):
     def __len__(self):
         return sum(map(len, self._value))
 
+    def dump(self, target):
+        target.dump(self.value)
+
+
+class SpillingArrayAccumulator(ArrayAccumulator):
+    """
+    ArrayAccumulator that appends the arrays of every added chunk to a growable npy file in spill_dir,
+    only the array of the chunk it was created with is kept in memory until the first add
+    """
+
+    def __init__(self, value, spill_dir):
+        super().__init__(value)
+        self.spill_dir = spill_dir
+        self._file = None
+
+    def __repr__(self):
+        return "%s(%d rows, %s)" % (self.__class__.__name__, len(self), self._file.path if self._file else "in memory")
+
+    def __deepcopy__(self, memo):
+        # the copy gets its own file, both are appended to independently
+        out = self.__class__(self._empty, self.spill_dir)
+        out._value = list(self._value)
+        if self._file is not None:
+            out._spill([])
+            out._file.append_file(self._file)
+        return out
+
+    def identity(self):
+        return self.__class__(self._empty, self.spill_dir)
+
+    def _spill(self, arrays):
+        if self._file is None:
+            self._file = NpyAppender.like(os.path.join(self.spill_dir, uuid.uuid4().hex + ".npy"), self._empty)
+        for array in self._value + list(arrays):
+            self._file.append(array)
+        self._value = [self._empty]
+
+    def add(self, other):
+        assert self._empty.shape[1:] == other._empty.shape[1:]
+        assert self._empty.dtype == other._empty.dtype
+        # rows stay in the order of the adds, so the arrays of a category stay aligned
+        self._spill([])
+        if getattr(other, "_file", None) is not None:
+            self._file.append_file(other._file)
+        self._spill(v for v in other._value if len(v))
+
+    @property
+    def value(self):
+        if self._file is None:
+            return super().value
+        self._spill([])
+        return self._file.open()
+
+    def __len__(self):
+        return super().__len__() + (self._file.rows if self._file else 0)
+
+    def dump(self, target):
+        if self._file is None:
+            return super().dump(target)
+        # the spill file already is the finished npy, it is only moved
+        self._spill([])
+        os.replace(self._file.path, target.path)
+        self._file = None
+
 
 class ArrayExporter(BaseProcessor, BaseSelection):
     output = "*.npy"
     dtype = None
     sep = "_"
 
-    def __init__(self, task, Lepton, additional_plots=False):
+    def __init__(self, task, Lepton, additional_plots=False, systematics=False, spill_dir=None):
         super().__init__(task)
         self.Lepton = Lepton
         self.additional_plots = additional_plots
+        self.systematics = systematics
+        # merged arrays are appended to files in spill_dir instead of being kept in memory
+        self.spill_dir = spill_dir
+        # the exported categories only need the fused masks
+        self.keep_cut_masks = additional_plots
 
         self._accumulator["arrays"] = dict_accumulator()
 
+    def array_accumulator(self, array):
+        if self.spill_dir:
+            return SpillingArrayAccumulator(array, self.spill_dir)
+        return ArrayAccumulator(array)
+
     def categories(self, select_output):
         # For reference the categories here are e.g. 0b or multi b
-        # Creates dict where all selection are applied -> {category: combined selection per category}
-        selection = select_output.get("selection")
-        categories = select_output.get("categories")
-        return {cat: selection.all(*cuts) for cat, cuts in categories.items()} if selection and categories else {"all": slice(None)}
+        # {category: fused mask of all its cuts}, also used to split the mass points
+        category_masks = select_output.get("category_masks")
+        return category_masks if category_masks else {"all": slice(None)}
 
     def select(self, events):
         # applies selction and returns all variables and all defined objects
@@ -399,51 +470,27 @@ class ArrayExporter(BaseProcessor, BaseSelection):
         arrays = self.get_selection_as_np(selected_output)
         # setting weights as extra axis in arrays
         # arrays.setdefault("weights", np.stack([np.full_like(weights, 1), weights], axis=-1))
-        arrays.setdefault("weights", weights)
+        arrays.setdefault("weights", weights.astype(np.float32) if self.compact_dtypes else weights)
+        # (n_events, n_variations) matrix of all shifted weights
+        if self.systematics:
+            arrays.setdefault("systematics", selected_output["shifts"].matrix(weights))
         if self.dtype:
             arrays = {key: array.astype(self.dtype) for key, array in arrays.items()}
-        output["arrays"] = dict_accumulator({category + "_" + selected_output["dataset"]: dict_accumulator({key: ArrayAccumulator(array[cut, ...]) for key, array in arrays.items()}) for category, cut in categories.items()})
+        output["arrays"] = dict_accumulator({category + "_" + selected_output["dataset"]: dict_accumulator({key: self.array_accumulator(array[cut, ...]) for key, array in arrays.items()}) for category, cut in categories.items()})
+        # the same arrays again, split by mass point of the scan
+        masspoints = selected_output["masspoints"]
+        if masspoints is not None:
+            output["masspoints"] = dict_accumulator(
+                {
+                    category + "_" + selected_output["dataset"]: dict_accumulator({name: dict_accumulator({key: ArrayAccumulator(array[index, ...]) for key, array in arrays.items()}) for name, index in masspoints.split(None if isinstance(cut, slice) else cut).items()})
+                    for category, cut in categories.items()
+                }
+            )
         # option to do cutflow and N1 plots on the fly
         if self.additional_plots:
-            weights = selected_output["weights"]
-            for cat in selected_output["categories"].keys():
-                # filling cutflow hist
-                cutflow_cuts = set()
-                output["cutflow"].fill(
-                    dataset=selected_output["dataset"],
-                    category=cat,
-                    cutflow=np.array([0]),
-                    weight=np.array([weights.weight().sum()]),
-                )
-                selection = selected_output.get("selection")
-                categories = selected_output.get("categories")
-                for i, cutflow_cut in enumerate(categories[cat]):
-                    cutflow_cuts.add(cutflow_cut)
-                    cutflow_cut = selection.all(*cutflow_cuts)
-                    output["cutflow"].fill(
-                        dataset=selected_output["dataset"],
-                        category=cat,
-                        cutflow=np.array([i + 1]),
-                        weight=np.array([weights.weight()[cutflow_cut].sum()]),
-                    )
-                # filling N-1 plots
-                output["n_minus1"].fill(
-                    dataset=selected_output["dataset"],
-                    category=cat,
-                    cutflow=np.array([0]),
-                    weight=np.array([weights.weight().sum()]),
-                )
-                allCuts = set(categories[cat])
-                for i, cut in enumerate(categories[cat]):
-                    output["n_minus1"].fill(
-                        dataset=selected_output["dataset"],
-                        category=cat,
-                        cutflow=np.array([i + 1]),
-                        weight=np.array([weights.weight()[selection.all(*(allCuts - {cut}))].sum()]),
-                    )
-                # from IPython import embed; embed()
+            self.fill_cutflows(output, selected_output)
             # output["n_events"]["sumAllEvents"] += selected_output["size"]
-        return output
+        return self.tree_output(events, output)
 
     def postprocess(self, accumulator):
         return accumulator
@@ -490,10 +537,9 @@ class Histogramer(BaseProcessor, BaseSelection):
     def process(self, events):
         output = self.accumulator.identity()
         selected_output = self.base_select(events)
-        weights = selected_output["weights"]
+        weight = selected_output["weights"].weight()
         for cat in selected_output["categories"].keys():
             for var_name in self.variables().names():
-                weight = weights.weight()
                 # value = out[var_name]
                 # generate blank mask for variable values
                 mask = np.ones(len(selected_output[var_name]), dtype=bool)
@@ -513,41 +559,9 @@ class Histogramer(BaseProcessor, BaseSelection):
                 values["weight"] = weight[mask]
                 output["histograms"][var_name].fill(**values)
 
-            # filling cutflow hist
-            cutflow_cuts = set()
-            output["cutflow"].fill(
-                dataset=selected_output["dataset"],
-                category=cat,
-                cutflow=np.array([0]),
-                weight=np.array([weights.weight().sum()]),
-            )
-            selection, categories = self.categories(selected_output)
-            for i, cutflow_cut in enumerate(categories[cat]):
-                cutflow_cuts.add(cutflow_cut)
-                cutflow_cut = selection.all(*cutflow_cuts)
-                output["cutflow"].fill(
-                    dataset=selected_output["dataset"],
-                    category=cat,
-                    cutflow=np.array([i + 1]),
-                    weight=np.array([weights.weight()[cutflow_cut].sum()]),
-                )
-            # filling N-1 plots
-            output["n_minus1"].fill(
-                dataset=selected_output["dataset"],
-                category=cat,
-                cutflow=np.array([0]),
-                weight=np.array([weights.weight().sum()]),
-            )
-            allCuts = set(categories[cat])
-            for i, cut in enumerate(categories[cat]):
-                output["n_minus1"].fill(
-                    dataset=selected_output["dataset"],
-                    category=cat,
-                    cutflow=np.array([i + 1]),
-                    weight=np.array([weights.weight()[selection.all(*(allCuts - {cut}))].sum()]),
-                )
+        self.fill_cutflows(output, selected_output)
         output["n_events"]["sumAllEvents"] += selected_output["size"]
-        return output
+        return self.tree_output(events, output)
 
     def postprocess(self, accumulator):
         return accumulator
@@ -0,0 +1,143 @@
+"""
+Columnar output of the ArrayExporter
+Named, typed and compressed columns in parquet files with row group statistics,
+readers only load the columns they need and can skip row groups by their min/max
+The load functions work on the npy and the parquet outputs alike, local npy files
+are memory-mapped so only the columns and rows that are sliced are read from disk
+"""
+
+import law
+import numpy as np
+
+from utils.cuts import operators
+from utils.merging import VirtualArray
+from utils.systematics import variations
+
+# rows per row group, the min/max statistics are kept per group
+row_group_size = 100000
+
+
+def storage_dtypes(variables):
+    # storage dtype per exported variable as declared in the config, float32 if not set
+    return np.dtype([(var.name, np.dtype(var.get_aux("dtype", "float32"))) for var in variables])
+
+
+def compact_array(columns, dtype):
+    # mixed dtype columns as one structured array, each field keeps its own dtype
+    out = np.empty(len(columns[dtype.names[0]]) if dtype.names else 0, dtype=dtype)
+    for name in dtype.names:
+        out[name] = columns[name]
+    return out
+
+
+def as_matrix(array, dtype=np.float32):
+    # plain (n_events, n_variables) matrix for training, structured arrays are converted per field
+    if array.dtype.names is None:
+        return array
+    out = np.empty((len(array), len(array.dtype.names)), dtype=dtype)
+    for i, name in enumerate(array.dtype.names):
+        out[:, i] = array[name]
+    return out
+
+
+def systematic_column(variation):
+    return "systematics_" + variation
+
+
+def table_columns(arrays, var_names):
+    # hl matrix, weights and systematics of one category as named columns
+    hl = arrays["hl"]
+    if hl.dtype.names:
+        columns = {name: hl[name] for name in var_names}
+    else:
+        columns = {name: hl[:, i] for i, name in enumerate(var_names)}
+    columns["weights"] = arrays["weights"]
+    if "systematics" in arrays:
+        columns.update({systematic_column(name): arrays["systematics"][:, i] for i, name in enumerate(variations)})
+    return columns
+
+
+def write_table(path, columns, compression="zstd"):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({name: pa.array(np.ascontiguousarray(values)) for name, values in columns.items()})
+    pq.write_table(table, path, row_group_size=row_group_size, compression=compression, write_statistics=True)
+
+
+def read_table(path, columns=None, filters=None):
+    """
+    reads the named columns of a parquet output into numpy arrays
+    filters like [("LT", ">", 250)] skip whole row groups by their statistics, the remaining rows are filtered as well
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=columns, filters=filters)
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+
+def open_array(target, mmap_mode="r"):
+    """
+    read-only np.memmap view of a local npy target, nothing is read until the view is sliced
+    virtual merges are opened as VirtualArray, other targets, e.g. on remote file systems, are loaded as usual
+    """
+    if isinstance(target, law.LocalFileTarget) and target.path.endswith(".merge.json"):
+        # virtual merge, the job files are read through the manifest
+        return VirtualArray.load(target.path)
+    if mmap_mode and isinstance(target, law.LocalFileTarget) and target.path.endswith(".npy"):
+        return np.load(target.path, mmap_mode=mmap_mode)
+    return target.load()
+
+
+def load_columns(targets, names, var_names, filters=None):
+    """
+    named columns of one exported category, only these are read from parquet
+    rows failing filters, as for read_table, are dropped, parquet skips their row groups
+    """
+    if "table" in targets:
+        return read_table(targets["table"].path, columns=list(names), filters=filters)
+    filters = filters or []
+    needed = list(names) + [name for name, _, _ in filters if name not in names]
+    columns = {}
+    array = open_array(targets["array"]) if any(name in var_names for name in needed) else None
+    for name in needed:
+        if name == "weights":
+            columns[name] = np.asarray(open_array(targets["weights"]))
+        elif array.dtype.names:
+            columns[name] = array[name]
+        else:
+            columns[name] = array[:, var_names.index(name)]
+    if not filters:
+        return columns
+    mask = np.ones(len(columns[needed[0]]), dtype=bool)
+    for name, op, value in filters:
+        mask &= operators[op](columns[name], value)
+    return {name: columns[name][mask] for name in names}
+
+
+def count_rows(targets):
+    # rows of one exported category, parquet has them in its metadata
+    if "table" in targets:
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(targets["table"].path).metadata.num_rows
+    return len(open_array(targets["weights"]))
+
+
+def load_arrays(targets, var_names):
+    # hl matrix in the order of var_names and the weights, from either output
+    if "table" in targets:
+        columns = read_table(targets["table"].path, columns=list(var_names) + ["weights"])
+        dtypes = set(columns[name].dtype for name in var_names)
+        if len(dtypes) > 1:
+            # compact columns stay compact
+            return compact_array(columns, np.dtype([(name, columns[name].dtype) for name in var_names])), columns["weights"]
+        return np.stack([columns[name] for name in var_names], axis=-1), columns["weights"]
+    return open_array(targets["array"]), open_array(targets["weights"])
+
+
+def load_systematics(targets):
+    if "table" in targets:
+        columns = read_table(targets["table"].path, columns=[systematic_column(name) for name in variations])
+        return np.stack([columns[systematic_column(name)] for name in variations], axis=-1)
+    return open_array(targets["systematics"])
@@ -0,0 +1,98 @@
+"""
+Column dependencies of the skim reader
+Resolves which branches of the skimmed trees are needed for the configured
+variables, category cuts and weights, everything else is never read by the lazy
+events, its compressed size is reported from the branch sizes in the file index
+"""
+
+from utils.producers import registry
+
+# derived quantities of BaseSelection and the branches (or other derived quantities) they are built from
+derived_columns = registry.inputs()
+
+# extra inputs of the iso cut for stitched or scanned datasets
+dataset_columns = {
+    "TTToSemiLeptonic_TuneCP5_13TeV-powheg-pythia8": {"iso_cut": ["LHE_HTIncoming"]},
+    "TTTo2L2Nu_TuneCP5_13TeV-powheg-pythia8": {"iso_cut": ["LHE_HTIncoming"]},
+    "SMS-T5qqqqVV_TuneCP2_13TeV-madgraphMLM-pythia8": {"iso_cut": ["mGluino", "mNeutralino"]},
+}
+
+# trigger decisions are only read for data, MC passes these cuts by construction
+data_columns = {
+    "doubleCounting_XOR": ["HLT_EleOr", "HLT_MuonOr", "HLT_MetOr"],
+    "HLT_Or": ["HLT_EleOr", "HLT_MuonOr", "HLT_MetOr"],
+}
+
+# scale factors applied per lepton tree, each comes with Up and Down variations
+scale_factors = {
+    "Muon": ["MuonMediumSf", "MuonTriggerSf", "MuonMediumIsoSf"],
+    "Electron": ["ElectronTightSf", "ElectronRecoSf"],
+}
+
+
+class ColumnResolver:
+    """
+    walks config.variables, the category cuts and the weight definitions
+    and collects the derived quantities and skim branches they need
+    """
+
+    def __init__(self, config, treename):
+        self.config = config
+        self.treename = treename
+        requested = set(config.variables.names())
+        self.branch_cuts = set()
+        for cat in config.categories:
+            for cut in cat.get_aux("cuts"):
+                if cut[1] == "cut":
+                    # boolean cuts are derived quantities
+                    requested.add(cut[0])
+                else:
+                    # all other cuts act on branches of the tree
+                    self.branch_cuts.add(cut[0])
+        self.requested = requested
+        # derived quantities to compute, independent of the dataset
+        self.variables = self.expand(requested)[0]
+
+    def weight_columns(self, isData, dataset=None):
+        if isData:
+            return set()
+        columns = {"GenWeight", "PileUpWeight", "PileUpWeightUp", "PileUpWeightDown"}
+        if dataset != "SMS-T5qqqqVV_TuneCP2_13TeV-madgraphMLM-pythia8":
+            columns |= {"PreFireWeight", "PreFireWeightUp", "PreFireWeightDown"}
+        for sf in scale_factors.get(self.treename, []):
+            columns |= {sf, sf + "Up", sf + "Down"}
+        return columns
+
+    def expand(self, names, isData=False, dataset=None):
+        # recursively split names into derived quantities and branches
+        variables, columns = set(), set()
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name not in derived_columns:
+                columns.add(name)
+                continue
+            if name in variables:
+                continue
+            variables.add(name)
+            deps = derived_columns[name] + dataset_columns.get(dataset, {}).get(name, [])
+            if isData:
+                deps = deps + data_columns.get(name, [])
+            for dep in deps:
+                # some variables just carry the name of their branch
+                if dep == name:
+                    columns.add(dep)
+                else:
+                    todo.append(dep)
+        return variables, columns
+
+    def columns(self, isData, dataset=None):
+        # skim branches to read for one dataset
+        columns = self.expand(self.requested, isData=isData, dataset=dataset)[1]
+        return columns | self.branch_cuts | self.weight_columns(isData, dataset)
+
+    def skipped_bytes(self, branch_bytes, isData, dataset=None):
+        # compressed bytes of all branches that are never touched, branch_bytes as kept in the file index
+        needed = self.columns(isData, dataset)
+        skipped = sum(size for name, size in branch_bytes.items() if name not in needed)
+        return skipped, sum(branch_bytes.values())
@@ -0,0 +1,316 @@
+"""
+Compiled cut expressions
+The (variable, operator) tuples of the categories and the signal region strings
+are parsed once into vectorised comparisons, which work on awkward events as
+well as on the merged numpy arrays
+"""
+
+import operator
+import re
+
+import numpy as np
+
+operators = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+number = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+# "> 250" of a category cut tuple
+value_pattern = re.compile(r"^\s*(==|!=|>=|<=|>|<)\s*({})\s*$".format(number))
+# "(LT > 250)" of a signal region string
+term_pattern = re.compile(r"^\s*\(?\s*(\w+)\s*(==|!=|>=|<=|>|<)\s*({})\s*\)?\s*$".format(number))
+
+
+def parse_number(value):
+    return float(value) if any(c in value for c in ".eE") else int(value)
+
+
+class Cut:
+    """
+    a single comparison of one column, or a boolean column if there is no operator
+    """
+
+    def __init__(self, variable, op=None, value=None, label=None):
+        if op is not None and op not in operators:
+            raise ValueError("unknown operator {} in cut on {}".format(op, variable))
+        self.variable = variable
+        self.op = op
+        self.value = value
+        self.label = label or (variable if op is None else "{} {}{}".format(variable, op, value))
+
+    def __repr__(self):
+        return "Cut({})".format(self.label)
+
+    @classmethod
+    def from_tuple(cls, cut):
+        # ("iso_cut", "cut") or ("LT", ">250"), the label stays the joined tuple used in the cutflows
+        if cut[1] == "cut":
+            return cls(cut[0], label=" ".join(cut))
+        match = value_pattern.match(cut[1])
+        if not match:
+            raise ValueError("can not parse cut {}".format(cut))
+        return cls(cut[0], match.group(1), parse_number(match.group(2)), label=" ".join(cut))
+
+    def __call__(self, columns):
+        values = columns[self.variable]
+        if self.op is None:
+            # boolean columns of merged float arrays are 0 or 1, as in the expressions
+            return values != 0
+        return operators[self.op](values, self.value)
+
+    def expression(self, name):
+        # the cut as an expression on the input called name, for the string based backends
+        if self.op is None:
+            return "({} != 0)".format(name)
+        return "({} {} {!r})".format(name, self.op, self.value)
+
+
+def parse_region(conditions):
+    # signal region conditions are strings of comparisons joined by &
+    cuts = []
+    for condition in conditions:
+        for term in condition.split("&"):
+            match = term_pattern.match(term)
+            if not match:
+                raise ValueError("can not parse condition {}".format(condition))
+            cuts.append(Cut(match.group(1), match.group(2), parse_number(match.group(3)), label=term.strip()))
+    return cuts
+
+
+class ArrayColumns:
+    """
+    column access to a merged (n_events, n_variables) array by variable name
+    """
+
+    def __init__(self, array, var_names, aliases=None):
+        self.array = array
+        self.var_names = list(var_names)
+        self.aliases = aliases or {}
+
+    def __getitem__(self, name):
+        name = self.aliases.get(name, name)
+        # compact arrays are structured, with one field per variable
+        if self.array.dtype.names:
+            return self.array[name]
+        return self.array[:, self.var_names.index(name)]
+
+
+class EventColumns:
+    """
+    derived quantities of the selection first, then the branches of the events
+    """
+
+    def __init__(self, events, derived):
+        self.events = events
+        self.derived = derived
+
+    def __getitem__(self, name):
+        if name in self.derived:
+            return self.derived[name]
+        return self.events[name]
+
+
+class CompiledCuts:
+    """
+    a list of cuts combined with &, parsed once and evaluated per chunk or array
+    numpy works on everything, numexpr and numba fuse all comparisons into one pass over numpy inputs
+    """
+
+    backends = ["numpy", "numexpr", "numba"]
+
+    def __init__(self, cuts, backend="numpy"):
+        if backend not in self.backends:
+            raise ValueError("unknown cut backend {}, choose from {}".format(backend, self.backends))
+        self.cuts = list(cuts)
+        self.backend = backend
+        self.inputs = sorted(set(cut.variable for cut in self.cuts))
+        self._kernel = None
+
+    def __repr__(self):
+        return "CompiledCuts({}, backend={})".format(" & ".join(cut.label for cut in self.cuts), self.backend)
+
+    def __getstate__(self):
+        # compiled kernels are rebuilt after pickling to the workers
+        state = self.__dict__.copy()
+        state["_kernel"] = None
+        return state
+
+    @classmethod
+    def from_category(cls, category, backend="numpy"):
+        return cls([Cut.from_tuple(cut) for cut in category.get_aux("cuts")], backend=backend)
+
+    @classmethod
+    def from_region(cls, conditions, backend="numpy"):
+        return cls(parse_region(conditions), backend=backend)
+
+    @property
+    def labels(self):
+        return [cut.label for cut in self.cuts]
+
+    def masks(self, columns):
+        # the individual cuts, e.g. to fill a PackedSelection for the cutflow
+        return {cut.label: cut(columns) for cut in self.cuts}
+
+    def expression(self):
+        names = {var: "v{}".format(i) for i, var in enumerate(self.inputs)}
+        return " & ".join(cut.expression(names[cut.variable]) for cut in self.cuts)
+
+    def build_kernel(self):
+        if self.backend == "numexpr":
+            import numexpr
+
+            expression = self.expression()
+            return lambda *arrays: numexpr.evaluate(expression, local_dict={"v{}".format(i): array for i, array in enumerate(arrays)})
+        if self.backend == "numba":
+            import numba
+
+            names = ["v{}".format(i) for i in range(len(self.inputs))]
+            element = " and ".join(cut.expression(names[self.inputs.index(cut.variable)] + "[i]") for cut in self.cuts) or "True"
+            source = "def kernel({}):\n    out = np.empty({}, dtype=np.bool_)\n    for i in range(out.shape[0]):\n        out[i] = {}\n    return out\n".format(", ".join(names), names[0] + ".shape[0]" if names else "0", element)
+            namespace = {"np": np}
+            exec(source, namespace)
+            return numba.njit(namespace["kernel"])
+        return None
+
+    def __call__(self, columns):
+        # one combined mask of all cuts
+        if self.backend == "numpy" or not self.cuts:
+            mask = True
+            for cut in self.cuts:
+                mask = mask & cut(columns)
+            return mask
+        if self._kernel is None:
+            self._kernel = self.build_kernel()
+        return self._kernel(*[np.ascontiguousarray(columns[var]) for var in self.inputs])
+
+
+class CutflowBits:
+    """
+    all cuts of a category packed into one uint32 per event, bit i is set if the event passes cut i
+    cumulative cutflow and N-1 yields then come from the bits in one pass each
+    """
+
+    max_cuts = 32
+
+    def __init__(self, masks, size=None):
+        # size is the number of events, needed if there are no cuts
+        if len(masks) > self.max_cuts:
+            raise ValueError("can not pack {} cuts into {} bits".format(len(masks), self.max_cuts))
+        if not masks and size is None:
+            raise ValueError("the number of events is needed for a category without cuts")
+        self.n_cuts = len(masks)
+        self.all_bits = np.uint32((1 << self.n_cuts) - 1)
+        self.bits = np.zeros(len(masks[0]) if masks else size, dtype=np.uint32)
+        for i, mask in enumerate(masks):
+            self.bits |= np.asarray(mask, dtype=np.uint32) << np.uint32(i)
+        # bits of the failed cuts
+        self.missing = self.all_bits & ~self.bits
+
+    @staticmethod
+    def lowest_bit(values):
+        # index of the lowest set bit, values have to be non zero
+        return np.log2(values & (~values + np.uint32(1))).astype(np.int64)
+
+    def cutflow(self, weights):
+        # bin 0 all events, bin i the events passing the first i cuts
+        failed = self.missing != 0
+        n_passed = np.full(len(self.bits), self.n_cuts, dtype=np.int64)
+        n_passed[failed] = self.lowest_bit(self.missing[failed])
+        counts = np.bincount(n_passed, weights=weights, minlength=self.n_cuts + 1)
+        return np.cumsum(counts[::-1])[::-1]
+
+    def n_minus1(self, weights):
+        # bin 0 all events, bin i the events passing all cuts except cut i - 1
+        weights = np.asarray(weights)
+        missing = self.missing
+        all_passed = np.sum(weights[missing == 0])
+        single = (missing != 0) & ((missing & (missing - np.uint32(1))) == 0)
+        counts = np.bincount(self.lowest_bit(missing[single]), weights=weights[single], minlength=self.n_cuts)
+        return np.concatenate([[np.sum(weights)], counts + all_passed])
+
+
+class RegionBinning:
+    """
+    disjoint signal regions as bins: every variable is digitized at the thresholds of all regions
+    and a lookup table maps the cell of an event to its region, -1 if it is in no region
+    the yields of all regions then come from one bincount
+    """
+
+    def __init__(self, regions):
+        # regions: name -> list of Cut, all cuts need an operator
+        self.regions = regions
+        self.names = list(regions)
+        self.inputs = sorted(set(cut.variable for cuts in regions.values() for cut in cuts))
+        self.edges = {var: np.unique([cut.value for cuts in regions.values() for cut in cuts if cut.variable == var]).astype(np.float64) for var in self.inputs}
+        # one representative value per cell, the cells are below, at and between the edges
+        representatives = [self.representatives(self.edges[var]) for var in self.inputs]
+        grid = dict(zip(self.inputs, np.meshgrid(*representatives, indexing="ij")))
+        self.table = np.full(grid[self.inputs[0]].shape if self.inputs else (), -1, dtype=np.int64)
+        for i, name in enumerate(self.names):
+            inside = np.ones(self.table.shape, dtype=bool)
+            for cut in regions[name]:
+                inside &= cut(grid)
+            if np.any(inside & (self.table >= 0)):
+                raise ValueError("signal region {} overlaps with {}".format(name, self.names[self.table[inside & (self.table >= 0)][0]]))
+            self.table[inside] = i
+
+    def __repr__(self):
+        return "RegionBinning({} regions, inputs={})".format(len(self.names), self.inputs)
+
+    @classmethod
+    def from_regions(cls, regions):
+        # name -> list of condition strings, like signal_regions_0b
+        return cls({name: parse_region(conditions) for name, conditions in regions.items()})
+
+    def lower_bounds(self):
+        """
+        (variable, ">=", value) for every variable all regions bound from below, value is the lowest of these bounds
+        each event in a region passes them, e.g. to skip parquet row groups before the binning
+        """
+        out = []
+        for var in self.inputs:
+            bounds = [max((cut.value for cut in cuts if cut.variable == var and cut.op in (">", ">=")), default=None) for cuts in self.regions.values()]
+            if bounds and None not in bounds:
+                out.append((var, ">=", min(bounds)))
+        return out
+
+    @staticmethod
+    def representatives(edges):
+        # cell 2i is below edge i, cell 2i + 1 is edge i itself, the last cell is above all edges
+        between = np.concatenate([[edges[0] - 1], (edges[:-1] + edges[1:]) / 2, [edges[-1] + 1]])
+        out = np.empty(2 * len(edges) + 1)
+        out[0::2] = between
+        out[1::2] = edges
+        return out
+
+    def cells(self, values, edges):
+        # number of edges below the value plus the number of edges not above it
+        values = np.asarray(values, dtype=np.float64)
+        return np.digitize(values, edges, right=True) + np.digitize(values, edges)
+
+    def region_ids(self, columns):
+        cells = [self.cells(columns[var], self.edges[var]) for var in self.inputs]
+        ids = self.table[tuple(cells)]
+        # comparisons with nan are false, so these events are in no region
+        for var in self.inputs:
+            ids[np.isnan(np.asarray(columns[var], dtype=np.float64))] = -1
+        return ids
+
+    def yields(self, columns, weights=None):
+        """
+        counts, sum of weights and sum of squared weights of every region, one entry per name
+        """
+        ids = self.region_ids(columns)
+        inside = ids >= 0
+        ids = ids[inside]
+        n = len(self.names)
+        counts = np.bincount(ids, minlength=n)
+        if weights is None:
+            return counts, counts.astype(np.float64), counts.astype(np.float64)
+        weights = np.asarray(weights, dtype=np.float64)[inside]
+        return counts, np.bincount(ids, weights=weights, minlength=n), np.bincount(ids, weights=weights**2, minlength=n)
@@ -0,0 +1,173 @@
+"""
+Per-file metadata index of the skimmed ROOT files
+Built once at dataset discovery, so downstream tasks query a single SQLite
+file instead of reopening every ROOT file for metadata and cutflows
+Files are read in a thread pool, rows of files with unchanged size and mtime
+are taken from the index of an earlier build
+"""
+
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import uproot as up
+
+# column name and SQLite type of each row, one row per file
+index_columns = [
+    ("path", "TEXT PRIMARY KEY"),
+    ("dataset", "TEXT"),
+    ("entries", "TEXT"),
+    ("is_data", "INTEGER"),
+    ("is_fastsim", "INTEGER"),
+    ("primary_dataset", "TEXT"),
+    ("luminosity", "REAL"),
+    ("sum_gen_weight", "REAL"),
+    ("cutflows", "TEXT"),
+    ("branch_bytes", "TEXT"),
+    ("uuid", "TEXT"),
+    ("size", "INTEGER"),
+    ("mtime", "REAL"),
+]
+
+# stored as json strings
+json_columns = ["entries", "cutflows", "branch_bytes"]
+
+
+def read_file_metadata(data_path, path):
+    # everything downstream tasks need from one file, only metadata and header reads
+    full_path = data_path + "/" + path
+    stat = os.stat(full_path)
+    with up.open(full_path) as file:
+        classnames = {key.split(";")[0]: cls for key, cls in file.classnames(recursive=False).items()}
+        trees = [key for key, cls in classnames.items() if cls == "TTree" and key != "MetaData"]
+        metadata = file["MetaData"]
+        row = {
+            "path": path,
+            "dataset": path.split("/")[0],
+            "entries": {key: file[key].num_entries for key in trees},
+            "is_data": bool(metadata["IsData"].array()[0]),
+            "is_fastsim": bool(metadata["IsFastSim"].array()[0]),
+            "primary_dataset": str(metadata["primaryDataset"].array()[0]),
+            "luminosity": float(metadata["Luminosity"].array()[0]),
+            "sum_gen_weight": float(np.sum(metadata["SumGenWeight"].array())),
+            "cutflows": {key: file[key].values().tolist() for key in classnames if key.startswith("cutflow")},
+            # compressed bytes per branch, the size of what column pruning does not read
+            "branch_bytes": {key: {name: branch.compressed_bytes for name, branch in file[key].items()} for key in trees},
+            "uuid": file.file.fUUID.hex(),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+    return row
+
+
+class FileIndex:
+    """
+    read access to the index, rows are returned as dicts with decoded json columns
+    """
+
+    table = "files"
+
+    def __init__(self, path):
+        self.path = path
+        self._rows = None
+        self._datasets = None
+
+    @classmethod
+    def write(cls, path, rows):
+        # write to a temporary file first, so a crashed build never leaves a partial index
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        names = [name for name, _ in index_columns]
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.execute("CREATE TABLE {} ({})".format(cls.table, ", ".join("{} {}".format(name, kind) for name, kind in index_columns)))
+            db.executemany(
+                "INSERT INTO {} VALUES ({})".format(cls.table, ", ".join("?" * len(names))),
+                [tuple(json.dumps(row[name]) if name in json_columns else row[name] for name in names) for row in rows],
+            )
+            db.commit()
+        finally:
+            db.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    @classmethod
+    def build(cls, path, data_path, file_dict, cache_path=None, workers=1):
+        """
+        cache_path is an index kept between builds, e.g. of different versions, it is updated afterwards
+        """
+        files = [file for dataset_files in file_dict.values() for file in dataset_files]
+        cached = cls(cache_path).rows if cache_path and os.path.exists(cache_path) else {}
+        rows = {}
+        for file in files:
+            row = cached.get(file)
+            # rows of an index written before a column was added are read again
+            if row is not None and all(name in row for name, _ in index_columns):
+                stat = os.stat(data_path + "/" + file)
+                if row["size"] == stat.st_size and row["mtime"] == stat.st_mtime:
+                    rows[file] = row
+        missing = [file for file in files if file not in rows]
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            rows.update(zip(missing, pool.map(partial(read_file_metadata, data_path), missing)))
+        rows = [rows[file] for file in files]
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            cls.write(cache_path, rows)
+        return cls.write(path, rows)
+
+    @property
+    def rows(self):
+        # the index is small, so it is read once and kept
+        if self._rows is None:
+            db = sqlite3.connect(self.path)
+            try:
+                db.row_factory = sqlite3.Row
+                rows = db.execute("SELECT * FROM {}".format(self.table)).fetchall()
+            finally:
+                db.close()
+            self._rows = {}
+            for row in rows:
+                row = dict(row)
+                for name in json_columns:
+                    row[name] = json.loads(row[name])
+                # SQLite has no booleans
+                row["is_data"] = bool(row["is_data"])
+                row["is_fastsim"] = bool(row["is_fastsim"])
+                self._rows[row["path"]] = row
+        return self._rows
+
+    def get(self, path):
+        return self.rows[path]
+
+    def dataset_rows(self, dataset):
+        # grouped once, cutflows are asked for per dataset and histogram
+        if self._datasets is None:
+            self._datasets = {}
+            for row in self.rows.values():
+                self._datasets.setdefault(row["dataset"], []).append(row)
+        return self._datasets.get(dataset, [])
+
+    def entries(self, paths, trees=("Muon", "Electron")):
+        return {path: {tree: self.rows[path]["entries"].get(tree, 0) for tree in trees} for path in paths}
+
+    def branch_bytes(self, paths, tree):
+        # compressed bytes per branch of one tree, summed over paths
+        out = {}
+        for path in paths:
+            for name, size in self.rows[path]["branch_bytes"].get(tree, {}).items():
+                out[name] = out.get(name, 0) + size
+        return out
+
+    def sum_gen_weights(self):
+        out = {}
+        for row in self.rows.values():
+            out[row["dataset"]] = out.get(row["dataset"], 0.0) + row["sum_gen_weight"]
+        return out
+
+    def cutflow(self, dataset, name):
+        # cutflow histogram summed over all files of a dataset
+        return np.asarray(np.sum([row["cutflows"][name] for row in self.dataset_rows(dataset)], axis=0))
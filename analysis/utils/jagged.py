@@ -0,0 +1,58 @@
+"""
+Compiled kernels for the jagged branches of the skim
+Leading objects are copied straight from the offsets and content buffers into
+a dense padded block, instead of slicing, taking firsts and filling per object
+"""
+
+import awkward as ak
+import numba
+import numpy as np
+
+list_offset_layouts = (ak.layout.ListOffsetArray32, ak.layout.ListOffsetArrayU32, ak.layout.ListOffsetArray64)
+
+
+@numba.njit(cache=True)
+def _fill_leading(offsets, content, n, fill, out):
+    # out has the shape (n_events, n), offsets index into content
+    for i in range(offsets.shape[0] - 1):
+        start = offsets[i]
+        n_objects = min(offsets[i + 1] - start, n)
+        for j in range(n_objects):
+            out[i, j] = content[start + j]
+        for j in range(n_objects, n):
+            out[i, j] = fill
+
+
+def jagged_buffers(values):
+    """
+    offsets and content of a jagged branch as numpy views of its layout, nothing is copied
+    sliced arrays keep offsets into the full content, other layouts are packed first
+    """
+    layout = ak.to_layout(values, allow_record=False)
+    if isinstance(layout, ak.layout.VirtualArray):
+        layout = layout.array
+    if isinstance(layout, list_offset_layouts):
+        content = layout.content
+        if isinstance(content, ak.layout.VirtualArray):
+            content = content.array
+        if isinstance(content, ak.layout.NumpyArray):
+            return np.asarray(layout.offsets), np.asarray(content)
+    counts = np.asarray(ak.num(values, axis=1))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, ak.to_numpy(ak.flatten(values, axis=1))
+
+
+def leading_objects(branches, n, fill=-999):
+    """
+    the n leading objects of every branch of one collection as one dense (n_branches, n_events, n) float32 block,
+    returned as branch -> (n_events, n) view, missing objects are set to fill
+    """
+    branches = dict(branches)
+    out = None
+    for b, values in enumerate(branches.values()):
+        offsets, content = jagged_buffers(values)
+        if out is None:
+            out = np.empty((len(branches), len(offsets) - 1, n), dtype=np.float32)
+        _fill_leading(offsets, content, n, np.float32(fill), out[b])
+    return dict(zip(branches, out if out is not None else []))
@@ -0,0 +1,41 @@
+"""
+Mass point demultiplexing of the SMS scans
+All events of a scan file are grouped by (mGluino, mNeutralino) in one
+vectorised pass, so a full scan costs one read of the signal files
+"""
+
+import awkward as ak
+import numpy as np
+
+# datasets holding a whole mass scan, the mass point of an event is stored in mGluino and mNeutralino
+scan_datasets = ["SMS-T5qqqqVV_TuneCP2_13TeV-madgraphMLM-pythia8"]
+
+
+def masspoint_name(point):
+    return "{}_{}".format(*point)
+
+
+class MasspointGroups:
+    """
+    groups the events of a chunk by mass point, the inverse index is computed once
+    and reused for the sum of weights and the split of every category
+    """
+
+    def __init__(self, mGluino, mNeutralino):
+        points = np.stack([ak.to_numpy(mGluino), ak.to_numpy(mNeutralino)], axis=-1).astype(np.int64)
+        self.points, self.inverse = np.unique(points, axis=0, return_inverse=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.names = [masspoint_name(point) for point in self.points]
+
+    def sums(self, weights):
+        # e.g. the sum of generator weights per mass point
+        return dict(zip(self.names, np.bincount(self.inverse, weights=ak.to_numpy(weights), minlength=len(self.names))))
+
+    def split(self, mask=None):
+        # event indices per mass point, optionally only of the events passing mask
+        index = np.arange(len(self.inverse)) if mask is None else np.flatnonzero(mask)
+        inverse = self.inverse[index]
+        order = np.argsort(inverse, kind="stable")
+        counts = np.bincount(inverse, minlength=len(self.names))
+        parts = np.split(index[order], np.cumsum(counts)[:-1])
+        return {name: part for name, part, count in zip(self.names, parts, counts) if count}
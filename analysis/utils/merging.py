@@ -0,0 +1,193 @@
+"""
+Merging of the per job arrays of CoffeaProcessor
+A virtual merge only writes a manifest of the job files with their row offsets,
+VirtualArray reads it as one array, so nothing is copied until a slice is taken,
+materialize turns it into one npy file as an optional last step
+A physical merge takes the rows from the npy headers, allocates the merged file
+once and copies the job files into their slices, several merges run in parallel
+Histograms of the jobs are summed in batches by a process pool and the partial sums added up
+"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from utils.streaming import copy_rows, read_header
+
+
+def plan_segments(paths):
+    """
+    row offsets of the npy files in paths, returns the segments, dtype, inner shape and the total rows
+    the dtype and shape are taken from the segments with rows, empty jobs are not checked against them
+    """
+    segments, offset, dtype, inner_shape, first = [], 0, None, None, None
+    for segment_path in paths:
+        shape, segment_dtype = read_header(segment_path)
+        first = first or (segment_dtype, shape[1:])
+        if shape[0] and dtype is None:
+            dtype, inner_shape = segment_dtype, shape[1:]
+        elif shape[0] and (segment_dtype != dtype or shape[1:] != inner_shape):
+            raise ValueError("{} does not match the dtype and shape of the other segments".format(segment_path))
+        segments.append({"path": segment_path, "rows": shape[0], "offset": offset})
+        offset += shape[0]
+    if dtype is None and first is not None:
+        # only empty segments, the merge is empty with the layout of the first one
+        dtype, inner_shape = first
+    return segments, dtype, inner_shape, offset
+
+
+def write_virtual(path, paths):
+    """
+    manifest of the npy files in paths, the rows are taken from the npy headers
+    """
+    segments, dtype, inner_shape, offset = plan_segments(paths)
+    manifest = {
+        "descr": np.lib.format.dtype_to_descr(dtype) if dtype is not None else None,
+        "inner_shape": list(inner_shape or ()),
+        "rows": offset,
+        "segments": segments,
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+class VirtualArray:
+    """
+    the segments of a virtual merge as one array
+    contiguous row slices, column indices and fields only read the needed part of each segment,
+    any other index and np.asarray concatenate the segments
+    """
+
+    def __init__(self, manifest):
+        self.segments = manifest["segments"]
+        descr = manifest["descr"]
+        self.dtype = np.lib.format.descr_to_dtype(descr if isinstance(descr, str) else [tuple(field) for field in descr]) if descr else np.dtype(np.float32)
+        self.shape = (manifest["rows"],) + tuple(manifest["inner_shape"])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def __repr__(self):
+        return "VirtualArray(shape={}, dtype={}, {} segments)".format(self.shape, self.dtype, len(self.segments))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def segment(self, segment):
+        # memory maps are opened per access, a merge can have more segments than open files are allowed
+        return np.load(segment["path"], mmap_mode="r")
+
+    def empty(self, rest=()):
+        return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            parts = [self.segment(segment)[key] for segment in self.segments if segment["rows"]]
+            return np.concatenate(parts) if parts else self.empty()[key]
+        rows, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if not isinstance(rows, slice) or rows.step not in (None, 1):
+            return np.asarray(self)[key]
+        start, stop, _ = rows.indices(len(self))
+        parts = []
+        for segment in self.segments:
+            first, last = max(start - segment["offset"], 0), min(stop - segment["offset"], segment["rows"])
+            if first < last:
+                parts.append(self.segment(segment)[(slice(first, last),) + rest])
+        return np.concatenate(parts) if parts else self.empty(rest)
+
+    def iter_chunks(self, rows=copy_rows):
+        # the rows segment by segment, at most rows at once
+        for segment in self.segments:
+            array = self.segment(segment)
+            for start in range(0, len(array), rows):
+                yield array[start : start + rows]
+
+    def __array__(self, dtype=None):
+        out = np.empty(self.shape, dtype=self.dtype)
+        start = 0
+        for chunk in self.iter_chunks():
+            out[start : start + len(chunk)] = chunk
+            start += len(chunk)
+        return out if dtype is None else out.astype(dtype)
+
+    def materialize(self, path):
+        # physical merge of the segments into one npy file, returns the rows
+        return merge_into(path, [segment["path"] for segment in self.segments])
+
+
+def merge_into(path, paths):
+    """
+    physical merge of the npy files in paths into path, the file is allocated once at its final size
+    """
+    segments, dtype, inner_shape, rows = plan_segments(paths)
+    if dtype is None:
+        raise ValueError("nothing to merge into {}".format(path))
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(rows,) + tuple(inner_shape))
+    for segment in segments:
+        if not segment["rows"]:
+            continue
+        array = np.load(segment["path"], mmap_mode="r")
+        for start in range(0, len(array), copy_rows):
+            stop = min(start + copy_rows, len(array))
+            out[segment["offset"] + start : segment["offset"] + stop] = array[start:stop]
+    out.flush()
+    del out
+    return rows
+
+
+def merge_parallel(merges, workers=1):
+    """
+    merges is a list of (path, paths), independent merges are filled by a pool of workers
+    returns the rows of each merged file
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return list(pool.map(lambda merge: merge_into(*merge), merges))
+
+
+def materialize_parallel(manifests, workers=1):
+    """
+    manifests is a list of (manifest path, path), the virtual merges are made physical by a pool of workers
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return list(pool.map(lambda item: VirtualArray.load(item[0]).materialize(item[1]), manifests))
+
+
+def sum_loaded(batch):
+    # batch is a list of target tuples, the histograms at the same position are added
+    out = None
+    for targets in batch:
+        hists = [target.load() for target in targets]
+        if out is None:
+            out = hists
+        else:
+            for total, hist in zip(out, hists):
+                total.add(hist)
+    return out
+
+
+def reduce_histograms(items, workers=1, batches_per_worker=4):
+    """
+    sums of the histograms in items, a list of target tuples, e.g. (cutflow, n_minus1) per job
+    the loading and the first level of sums is spread over a process pool, the partial sums are added here
+    returns None if there is nothing to sum
+    """
+    if not items:
+        return None
+    if workers <= 1:
+        return sum_loaded(items)
+    n_batches = min(len(items), workers * batches_per_worker)
+    batches = [items[i::n_batches] for i in range(n_batches)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        partials = list(pool.map(sum_loaded, batches))
+    out = partials[0]
+    for partial in partials[1:]:
+        for total, hist in zip(out, partial):
+            total.add(hist)
+    return out
@@ -0,0 +1,226 @@
+"""
+Registry of the derived quantities of BaseSelection
+Every producer declares the branches or other quantities it is built from,
+per chunk a quantity is only computed when a variable or cut asks for it and then kept
+"""
+
+from collections.abc import Mapping
+
+import awkward as ak
+import numpy as np
+
+from utils.jagged import leading_objects
+
+
+class Producer:
+    def __init__(self, name, func, inputs):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+
+    def __repr__(self):
+        return "Producer({}, inputs={})".format(self.name, self.inputs)
+
+
+class VariableRegistry:
+    """
+    name -> producer, producers are called with the events and the lazy variables of the chunk
+    """
+
+    def __init__(self):
+        self.producers = {}
+
+    def register(self, name, inputs):
+        def decorator(func):
+            if name in self.producers:
+                raise ValueError("variable {} is already registered".format(name))
+            self.producers[name] = Producer(name, func, inputs)
+            return func
+
+        return decorator
+
+    def add(self, name, func, inputs):
+        self.register(name, inputs)(func)
+
+    def inputs(self):
+        return {name: producer.inputs for name, producer in self.producers.items()}
+
+    def __contains__(self, name):
+        return name in self.producers
+
+    def __getitem__(self, name):
+        return self.producers[name]
+
+    def view(self, events, context=None):
+        return LazyVariables(self, events, context)
+
+
+class LazyVariables(Mapping):
+    """
+    the derived quantities of one chunk, computed on first access and memoized
+    """
+
+    def __init__(self, registry, events, context=None):
+        self.registry = registry
+        self.events = events
+        # anything a producer needs beside the events, e.g. the process of the dataset
+        self.context = context or {}
+        self.cache = {}
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            if name not in self.registry:
+                raise KeyError(name)
+            self.cache[name] = self.registry[name].func(self.events, self)
+        return self.cache[name]
+
+    def __iter__(self):
+        return iter(self.registry.producers)
+
+    def __len__(self):
+        return len(self.registry.producers)
+
+    def __contains__(self, name):
+        return name in self.registry
+
+
+registry = VariableRegistry()
+
+
+# jagged branches of one collection share their counts, the leading objects of a collection are filled in one call
+# collection -> (branches, number of leading objects, fill), e.g. JetPtLeading is a dense (n_events, 2) block
+leading_collections = {
+    "Jet": (["JetPt", "JetEta", "JetPhi", "JetMass"], 2, -999),
+    "Muon": (["MuonPt", "MuonEta", "MuonPhi"], 1, -999),
+    "Electron": (["ElectronPt", "ElectronEta", "ElectronPhi"], 1, -999),
+    "FatJet": (["FatJetDeepTagTvsQCD", "FatJetDeepTagWvsQCD"], 1, -999),
+    "IsoTrack": (["IsoTrackPt", "IsoTrackMt2"], 1, -999),
+    # ids are filled with False if there is no object
+    "MuonId": (["MuonMediumId"], 1, 0),
+    "ElectronId": (["ElectronTightId"], 1, 0),
+}
+
+
+def add_leading(collection, branches, n, fill):
+    registry.add("Leading" + collection, lambda events, var: leading_objects({branch: events[branch] for branch in branches}, n, fill), branches)
+    for branch in branches:
+        registry.add(branch + "Leading", lambda events, var, branch=branch: var["Leading" + collection][branch], ["Leading" + collection])
+
+
+for collection, (branches, n, fill) in leading_collections.items():
+    add_leading(collection, branches, n, fill)
+
+
+def leading(var, branch, index):
+    # value of the index-th object, -999 if there are not enough objects
+    return var[branch + "Leading"][:, index]
+
+
+# base variables
+registry.add("ntFatJets", lambda events, var: leading(var, "FatJetDeepTagTvsQCD", 0), ["FatJetDeepTagTvsQCDLeading"])
+registry.add("nWFatJets", lambda events, var: leading(var, "FatJetDeepTagWvsQCD", 0), ["FatJetDeepTagWvsQCDLeading"])
+registry.add("jetMass_1", lambda events, var: leading(var, "JetMass", 0), ["JetMassLeading"])
+registry.add("jetPt_1", lambda events, var: leading(var, "JetPt", 0), ["JetPtLeading"])
+registry.add("jetEta_1", lambda events, var: leading(var, "JetEta", 0), ["JetEtaLeading"])
+registry.add("jetPhi_1", lambda events, var: leading(var, "JetPhi", 0), ["JetPhiLeading"])
+registry.add("jetMass_2", lambda events, var: leading(var, "JetMass", 1), ["JetMassLeading"])
+registry.add("jetPt_2", lambda events, var: leading(var, "JetPt", 1), ["JetPtLeading"])
+registry.add("jetEta_2", lambda events, var: leading(var, "JetEta", 1), ["JetEtaLeading"])
+registry.add("jetPhi_2", lambda events, var: leading(var, "JetPhi", 1), ["JetPhiLeading"])
+registry.add("nJets", lambda events, var: events.nJet, ["nJet"])
+registry.add("LT", lambda events, var: events.LT, ["LT"])
+registry.add("HT", lambda events, var: events.HT, ["HT"])
+registry.add("metPt", lambda events, var: events.MetPt, ["MetPt"])
+registry.add("WBosonMt", lambda events, var: events.WBosonMt, ["WBosonMt"])
+registry.add("dPhi", lambda events, var: events.DeltaPhi, ["DeltaPhi"])
+registry.add("nbJets", lambda events, var: events.nDeepJetMediumBTag, ["nDeepJetMediumBTag"])
+# name with underscores lead to problems
+registry.add("zerob", lambda events, var: var["nbJets"] == 0, ["nbJets"])
+registry.add("multib", lambda events, var: var["nbJets"] >= 1, ["nbJets"])
+# variables to check cuts
+registry.add("correctedMetPt", lambda events, var: events.CorrectedMetPt, ["CorrectedMetPt"])
+registry.add("isoTrackPt", lambda events, var: leading(var, "IsoTrackPt", 0), ["IsoTrackPtLeading"])
+registry.add("isoTrackMt2", lambda events, var: leading(var, "IsoTrackMt2", 0), ["IsoTrackMt2Leading"])
+
+# muon variables
+registry.add("nMuon", lambda events, var: events.nMuon, ["nMuon"])
+registry.add("leadMuonPt", lambda events, var: leading(var, "MuonPt", 0), ["MuonPtLeading"])
+registry.add("leadMuonEta", lambda events, var: leading(var, "MuonEta", 0), ["MuonEtaLeading"])
+registry.add("leadMuonPhi", lambda events, var: leading(var, "MuonPhi", 0), ["MuonPhiLeading"])
+registry.add("muonCharge", lambda events, var: events.MuonCharge, ["MuonCharge"])
+registry.add("muonPdgId", lambda events, var: events.MuonPdgId, ["MuonPdgId"])
+
+# electron variables
+registry.add("nElectron", lambda events, var: events.nElectron, ["nElectron"])
+registry.add("leadElectronPt", lambda events, var: leading(var, "ElectronPt", 0), ["ElectronPtLeading"])
+registry.add("leadElectronEta", lambda events, var: leading(var, "ElectronEta", 0), ["ElectronEtaLeading"])
+registry.add("leadElectronPhi", lambda events, var: leading(var, "ElectronPhi", 0), ["ElectronPhiLeading"])
+registry.add("electronCharge", lambda events, var: events.ElectronCharge, ["ElectronCharge"])
+registry.add("electronPdgId", lambda events, var: events.ElectronPdgId, ["ElectronPdgId"])
+registry.add("vetoElectron", lambda events, var: (events.ElectronPt[:, 1:2] > 10) & events.ElectronLooseId[:, 1:2], ["ElectronPt", "ElectronLooseId"])
+
+# selection
+registry.add("sortedJets", lambda events, var: ak.mask(events.JetPt, (events.nJet >= 3)), ["JetPt", "nJet"])
+registry.add("goodJets", lambda events, var: (events.JetPt > 30) & (abs(events.JetEta) < 2.4), ["JetPt", "JetEta"])
+registry.add("subleading_jet", lambda events, var: leading(var, "JetPt", 1) > 80, ["JetPtLeading"])
+
+
+@registry.register("hard_lep", inputs=["MuonPtLeading", "ElectronPtLeading", "MuonEtaLeading", "ElectronEtaLeading"])
+def hard_lep(events, var):
+    mu_pt = leading(var, "MuonPt", 0)
+    e_pt = leading(var, "ElectronPt", 0)
+    mu_eta = leading(var, "MuonEta", 0)
+    e_eta = leading(var, "ElectronEta", 0)
+    return ((mu_pt > 25) | (e_pt > 25)) & ((abs(mu_eta) < 2.4) | (abs(e_eta) < 2.4))
+
+
+@registry.register("selected", inputs=["MuonMediumIdLeading", "ElectronTightIdLeading", "nGoodMuon", "nGoodElectron"])
+def selected(events, var):
+    mu_id = leading(var, "MuonMediumId", 0) > 0
+    e_id = leading(var, "ElectronTightId", 0) > 0
+    return (mu_id | e_id) & ((events.nGoodMuon == 1) | (events.nGoodElectron == 1))
+
+
+registry.add("no_veto_lepton", lambda events, var: (events.nVetoMuon - events.nGoodMuon == 0) & (events.nVetoElectron - events.nGoodElectron == 0), ["nVetoMuon", "nGoodMuon", "nVetoElectron", "nGoodElectron"])
+# njet_cut = ak.num(goodJets) >= 3
+registry.add("njet_cut", lambda events, var: ak.sum(events.JetIsClean, axis=1) >= 3, ["JetIsClean"])
+
+
+@registry.register("iso_cut", inputs=["IsoTrackVeto"])
+def iso_cut(events, var):
+    iso_cut = ~events.IsoTrackVeto
+    # stitch ttbar at events.LHE_HTIncoming < 600
+    if events.metadata["dataset"] == "TTToSemiLeptonic_TuneCP5_13TeV-powheg-pythia8" or events.metadata["dataset"] == "TTTo2L2Nu_TuneCP5_13TeV-powheg-pythia8":
+        LHE_HT_cut = events.LHE_HTIncoming < 600
+        # plug it on onto iso_cut, so cutflow is consistent
+        iso_cut = iso_cut & LHE_HT_cut
+
+    # when demultiplexing, all mass points of the scan are kept and split later
+    if events.metadata["dataset"] == "SMS-T5qqqqVV_TuneCP2_13TeV-madgraphMLM-pythia8" and not var.context.get("demultiplex"):
+        proc = var.context["proc"]
+        mGlu_cut = events.mGluino == proc.aux["masspoint"][0]
+        mNeu_cut = events.mNeutralino == proc.aux["masspoint"][1]
+        iso_cut = iso_cut & (mGlu_cut) & (mNeu_cut)
+    return iso_cut
+
+
+# prevent double counting in data, MC passes without reading the trigger bits
+@registry.register("doubleCounting_XOR", inputs=[])
+def doubleCounting_XOR(events, var):
+    if not events.metadata["isData"]:
+        return np.ones(len(events), dtype=bool)
+    return ((events.metadata["PD"] == "isSingleElectron") & events.HLT_EleOr) | ((events.metadata["PD"] == "isSingleMuon") & events.HLT_MuonOr & ~events.HLT_EleOr) | ((events.metadata["PD"] == "isMet") & events.HLT_MetOr & ~events.HLT_MuonOr & ~events.HLT_EleOr)
+
+
+# HLT Combination
+@registry.register("HLT_Or", inputs=[])
+def HLT_Or(events, var):
+    if not events.metadata["isData"]:
+        return np.ones(len(events), dtype=bool)
+    return events.HLT_MuonOr | events.HLT_MetOr | events.HLT_EleOr
+
+
+# ghost muon filter
+registry.add("ghost_muon_filter", lambda events, var: events.MetPt / events.CaloMET_pt <= 5, ["MetPt", "CaloMET_pt"])
+# data cut for control plots
+registry.add("data_cut", lambda events, var: (events.LT > 250) & (events.HT > 500) & (ak.num(var["goodJets"]) >= 3), ["LT", "HT", "goodJets"])
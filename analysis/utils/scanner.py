@@ -0,0 +1,99 @@
+"""
+Incremental scan of the skim directory
+Every dataset directory is listed with os.scandir in a thread pool, the listing,
+mtime and the size and mtime of every file are cached, a refresh only lists
+directories whose mtime changed since the last scan
+Every file gets a job number the first time it is seen, the numbers are cached
+as well, so new files never renumber the jobs of known ones
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def scan_tree(path, cache):
+    """
+    files below path as relative name -> [size, mtime], cache holds the listings of the last scan
+    returns the files and the new cache entries of path and its subdirectories
+    """
+    stat = os.stat(path)
+    cached = cache.get(path)
+    if cached is None or cached["mtime"] != stat.st_mtime:
+        # directory changed, list it again
+        files, dirs = {}, []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    entry_stat = entry.stat()
+                    files[entry.name] = [entry_stat.st_size, entry_stat.st_mtime]
+        cached = {"mtime": stat.st_mtime, "files": files, "dirs": sorted(dirs)}
+    new_cache = {path: cached}
+    out = dict(cached["files"])
+    # unchanged directories can still hold changed subdirectories
+    for name in cached["dirs"]:
+        sub_files, sub_cache = scan_tree(os.path.join(path, name), cache)
+        out.update({name + "/" + file: info for file, info in sub_files.items()})
+        new_cache.update(sub_cache)
+    return out, new_cache
+
+
+class DatasetScanner:
+    """
+    datasets are the directories directly below directory_path, files are stored as dataset/file
+    the order of the files of a dataset is kept from scan to scan, new files are appended
+    job_numbers holds the number of every file of the last scan, new files are numbered after all known ones
+    """
+
+    def __init__(self, directory_path, cache_path=None, workers=8):
+        self.directory_path = directory_path
+        self.cache_path = cache_path
+        self.workers = workers
+        self.job_numbers = {}
+
+    def load_cache(self):
+        if self.cache_path and os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if cache.get("directory_path") == self.directory_path:
+                return cache
+        return {"directory_path": self.directory_path, "listings": {}, "datasets": {}, "job_numbers": {}}
+
+    def save_cache(self, cache):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path + ".tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+    def scan(self):
+        """
+        returns dataset -> list of dataset/file, the job numbers of these files are kept in job_numbers
+        """
+        cache = self.load_cache()
+        with os.scandir(self.directory_path) as entries:
+            datasets = sorted(entry.name for entry in entries if entry.is_dir())
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda dataset: scan_tree(os.path.join(self.directory_path, dataset), cache["listings"]), datasets))
+        file_dict, listings = {}, {}
+        for dataset, (files, dataset_cache) in zip(datasets, results):
+            names = [dataset + "/" + file for file in files]
+            # known files keep their position, new ones are appended in sorted order
+            known = [name for name in cache["datasets"].get(dataset, []) if name[len(dataset) + 1 :] in files]
+            new = sorted(set(names) - set(known))
+            file_dict[dataset] = known + new
+            listings.update(dataset_cache)
+        # removed files keep their number, so it is never given to another file
+        numbers = dict(cache.get("job_numbers", {}))
+        next_number = max(numbers.values(), default=-1) + 1
+        for dataset in datasets:
+            for name in file_dict[dataset]:
+                if name not in numbers:
+                    numbers[name] = next_number
+                    next_number += 1
+        self.job_numbers = {name: numbers[name] for names in file_dict.values() for name in names}
+        self.save_cache({"directory_path": self.directory_path, "listings": listings, "datasets": file_dict, "job_numbers": numbers})
+        return file_dict
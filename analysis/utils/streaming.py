@@ -0,0 +1,81 @@
+"""
+Growable npy files for the exported arrays
+Rows are appended to the end of the file and the header is rewritten with the
+new shape after each append, so the file is a valid npy at any time and the
+arrays of a branch never have to be held in memory at once
+"""
+
+import os
+
+import numpy as np
+
+# npy header of version 1.0: magic string, version and the length as little endian uint16
+magic = b"\x93NUMPY\x01\x00"
+# rows of a file copied at once when appending one file to another
+copy_rows = 100000
+
+
+def header_string(dtype, shape):
+    return repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": tuple(shape)})
+
+
+def header_length(dtype, inner_shape):
+    # room for a row count of 20 digits, so the header never has to grow, aligned to 64 bytes
+    length = len(magic) + 2 + len(header_string(dtype, (10**20,) + tuple(inner_shape))) + 1
+    return -(-length // 64) * 64
+
+
+class NpyAppender:
+    """
+    npy file at path that grows by whole rows, the inner shape and dtype are fixed by the first array
+    """
+
+    def __init__(self, path, dtype, inner_shape):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.inner_shape = tuple(inner_shape)
+        self.length = header_length(self.dtype, self.inner_shape)
+        self.rows = 0
+        with open(self.path, "wb") as f:
+            self.write_header(f)
+
+    @classmethod
+    def like(cls, path, array):
+        return cls(path, array.dtype, array.shape[1:])
+
+    def write_header(self, f):
+        header = header_string(self.dtype, (self.rows,) + self.inner_shape)
+        header = header.ljust(self.length - len(magic) - 2 - 1) + "\n"
+        f.seek(0)
+        f.write(magic + np.uint16(len(header)).astype("<u2").tobytes() + header.encode("latin1"))
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        assert array.shape[1:] == self.inner_shape
+        if not len(array):
+            return
+        with open(self.path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.write(array.tobytes())
+            self.rows += len(array)
+            self.write_header(f)
+
+    def append_file(self, other):
+        # rows of another appender, read block by block through a memory map
+        view = other.open()
+        for start in range(0, len(view), copy_rows):
+            self.append(view[start : start + copy_rows])
+
+    def open(self):
+        return np.load(self.path, mmap_mode="r")
+
+
+def read_header(path):
+    # dtype and shape of an npy file without reading its data
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
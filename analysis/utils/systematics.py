@@ -0,0 +1,62 @@
+"""
+Systematic variations of the event weights
+Every up and down shift of the scale factors, pile-up and prefire weights is
+exported as one column of a (n_events, n_variations) float32 matrix, so all
+shifted templates come from a single read of the arrays
+"""
+
+import awkward as ak
+import numpy as np
+
+from utils.columns import scale_factors
+
+# weights with up and down shifts, the matrix has the same columns for both lepton trees
+shifted_weights = [sf for sfs in scale_factors.values() for sf in sfs] + ["PileUpWeight", "PreFireWeight"]
+variations = [name + shift for name in shifted_weights for shift in ("Up", "Down")]
+
+
+def shift_ratio(shifted, nominal):
+    # relative shift, events with a vanishing nominal weight stay unshifted
+    shifted, nominal = ak.to_numpy(shifted), ak.to_numpy(nominal)
+    return np.divide(shifted, nominal, out=np.ones(len(nominal), dtype=np.float64), where=nominal != 0)
+
+
+class WeightShifts:
+    """
+    adds weights to a coffea Weights object and keeps the relative up and down shifts
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.ratios = {}
+
+    def add(self, name, weight, weightUp=None, weightDown=None):
+        self.weights.add(name, weight, weightUp=weightUp, weightDown=weightDown)
+        if weightUp is not None:
+            self.ratios[name + "Up"] = shift_ratio(weightUp, weight)
+        if weightDown is not None:
+            self.ratios[name + "Down"] = shift_ratio(weightDown, weight)
+
+    def matrix(self, nominal=None):
+        # nominal weight times the relative shift, weights not present in this tree give the nominal
+        nominal = self.weights.weight() if nominal is None else nominal
+        out = np.repeat(np.asarray(nominal, dtype=np.float32)[:, None], len(variations), axis=1)
+        for i, name in enumerate(variations):
+            if name in self.ratios:
+                out[:, i] *= self.ratios[name]
+        return out
+
+
+def shifted_templates(values, nominal, systematics, edges):
+    """
+    nominal and all shifted histograms of one variable, the bin index is computed once
+    returns the nominal counts and a dict variation -> counts
+    """
+    edges = np.asarray(edges)
+    n_bins = len(edges) - 1
+    index = np.digitize(values, edges) - 1
+    inside = (index >= 0) & (index < n_bins)
+    index = index[inside]
+    counts = np.bincount(index, weights=np.asarray(nominal)[inside], minlength=n_bins)
+    shifted = systematics[inside]
+    return counts, {name: np.bincount(index, weights=shifted[:, i], minlength=n_bins) for i, name in enumerate(variations)}